@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Benchmark de la clasificación Entrada/Salida de registros.procesar_registros
+#
+# Compara la clasificación actual con la anterior (determinar_tipo_registro
+# sobre todo el historial del usuario en cada registro) usando marcaciones
+# sintéticas, y verifica que ambas den exactamente el mismo resultado.
+# También mide la clasificación y la memoria del lote columnar (LoteRegistros)
+# y la memoria por registro leído del dispositivo (dict vs RegistroAsistencia),
+# y cuántos timestamps parsea el pipeline completo (clasificar, calcular horas
+# y formatear) con y sin un FechasRegistros compartido entre etapas.
+#
+# Uso: python scripts/benchmark_registros.py [--registros 100000] [--usuarios 500]
+
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import detectar_turno, contar_timestamps_parseados, FechasRegistros
+from calculos import calcular_horas_todos
+from registros import procesar_registros, formatear_registros_para_envio
+from lote_registros import LoteRegistros, NOMBRES_TIPO
+from registro_asistencia import RegistroAsistencia
+
+
+def determinar_tipo_registro_anterior(registro, registros_usuario):
+    """calculos.determinar_tipo_registro tal como era antes, comparando el texto ISO"""
+    registros_anteriores = [r for r in registros_usuario if r['timestamp'] < registro['timestamp']]
+    registros_anteriores.sort(key=lambda r: r['timestamp'], reverse=True)
+
+    if not registros_anteriores:
+        return 'Entrada'  # No hay registros previos
+
+    ultimo_tipo = registros_anteriores[0]['tipo']
+    return 'Salida' if ultimo_tipo == 'Entrada' else 'Entrada'
+
+
+def procesar_registros_anterior(registros):
+    """Implementación previa: O(n² log n) por usuario"""
+    registros_por_usuario = {}
+
+    for registro in registros:
+        user_id = registro['user_id']
+        registros_usuario = registros_por_usuario.get(user_id, [])
+
+        registro['tipo'] = determinar_tipo_registro_anterior(registro, registros_usuario)
+        hora = datetime.fromisoformat(registro['timestamp']).hour
+        registro['turno'] = detectar_turno(hora)
+
+        registros_usuario.append(registro)
+        registros_por_usuario[user_id] = registros_usuario
+
+    return [registro for registros_usuario in registros_por_usuario.values() for registro in registros_usuario]
+
+
+def generar_registros(total, usuarios, desordenados, semilla=42):
+    """Marcaciones sintéticas en orden cronológico, con una fracción fuera de orden"""
+    aleatorio = random.Random(semilla)
+    inicio = datetime(2025, 1, 1, 6, 0, 0)
+    registros = []
+    instante = inicio
+    for _ in range(total):
+        instante += timedelta(seconds=aleatorio.randint(0, 30))
+        registros.append({
+            'user_id': str(10000 + aleatorio.randrange(usuarios)),
+            'nombre': 'Usuario',
+            'timestamp': instante.isoformat(),
+            'status': 1,
+            'estacion': 'Benchmark',
+            'punch': 0,
+        })
+
+    # Intercambiar algunas posiciones cercanas para simular registros fuera de orden
+    for _ in range(int(total * desordenados)):
+        i = aleatorio.randrange(total - 1)
+        j = min(total - 1, i + aleatorio.randint(1, 50))
+        registros[i], registros[j] = registros[j], registros[i]
+    return registros
+
+
+def medir(funcion, registros):
+    """Tiempo de ejecución, resultado y timestamps parseados por `funcion`"""
+    datos = copy.deepcopy(registros)
+    parseos = contar_timestamps_parseados()
+    inicio = time.perf_counter()
+    resultado = funcion(datos)
+    return time.perf_counter() - inicio, resultado, contar_timestamps_parseados() - parseos
+
+
+def pipeline(registros, fechas=None):
+    """Clasificar, calcular horas y formatear para envío, como en el reporte"""
+    procesados = procesar_registros(registros, fechas)
+    horas = calcular_horas_todos(procesados, fechas)
+    return horas, formatear_registros_para_envio(procesados, 'Benchmark', fechas)
+
+
+def memoria_lote(registros):
+    """Memoria (bytes) de los registros como lista de diccionarios y como lote columnar"""
+    tracemalloc.start()
+    datos = copy.deepcopy(registros)
+    bytes_dicts = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    lote = LoteRegistros.desde_registros(datos)
+    bytes_lote = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return bytes_dicts, bytes_lote, lote
+
+
+def memoria_por_registro(registros):
+    """
+    Bytes por registro al construir las marcaciones como diccionarios (formato
+    anterior de construir_registro) y como RegistroAsistencia. Simula la
+    lectura del dispositivo: fechas datetime y textos nuevos en cada registro.
+    """
+    crudos = [(str(int(r['user_id'])), 'Usuario ' + r['user_id'], datetime.fromisoformat(r['timestamp']),
+               r['status'], ''.join(['Bench', 'mark']), r['punch']) for r in registros]
+
+    tracemalloc.start()
+    dicts = [{'user_id': u, 'nombre': n, 'timestamp': f.isoformat(), 'status': s, 'estacion': e, 'punch': p}
+             for u, n, f, s, e, p in crudos]
+    bytes_dicts = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del dicts
+
+    tracemalloc.start()
+    objetos = [RegistroAsistencia(u, n, f, s, e, p) for u, n, f, s, e, p in crudos]
+    bytes_objetos = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objetos
+    return bytes_dicts / len(registros), bytes_objetos / len(registros)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de procesar_registros")
+    parser.add_argument('--registros', type=int, default=100000)
+    parser.add_argument('--usuarios', type=int, default=500)
+    parser.add_argument('--desordenados', type=float, default=0.01,
+                        help="Fracción de registros intercambiados fuera de orden")
+    parser.add_argument('--sin-anterior', action='store_true',
+                        help="No ejecutar la implementación anterior (lenta)")
+    args = parser.parse_args()
+
+    registros = generar_registros(args.registros, args.usuarios, args.desordenados)
+    print(f"Registros: {args.registros}, usuarios: {args.usuarios}, fuera de orden: {args.desordenados:.1%}")
+
+    t_actual, resultado_actual, parseos = medir(procesar_registros, registros)
+    print(f"Actual:   {t_actual:8.3f} s, {parseos} timestamps parseados")
+
+    bytes_dicts, bytes_lote, lote = memoria_lote(registros)
+    inicio = time.perf_counter()
+    lote.clasificar()
+    t_lote = time.perf_counter() - inicio
+    print(f"Lote:     {t_lote:8.3f} s (clasificación columnar)")
+    print(f"Memoria:  {bytes_dicts / 1e6:.1f} MB en diccionarios, {bytes_lote / 1e6:.1f} MB en lote "
+          f"({bytes_dicts / max(bytes_lote, 1):.0f}x menos)")
+
+    t_separado, resultado_separado, parseos_separado = medir(pipeline, registros)
+    t_compartido, resultado_compartido, parseos_compartido = medir(
+        lambda datos: pipeline(datos, FechasRegistros()), registros)
+    print(f"Pipeline: {t_separado:8.3f} s, {parseos_separado} timestamps parseados (un caché por etapa)")
+    print(f"          {t_compartido:8.3f} s, {parseos_compartido} timestamps parseados (caché compartido)")
+    if resultado_separado != resultado_compartido:
+        print("Pipeline con caché compartido: resultado distinto")
+        return 1
+
+    por_dict, por_objeto = memoria_por_registro(registros)
+    print(f"Registro: {por_dict:.0f} bytes como dict, {por_objeto:.0f} bytes como RegistroAsistencia")
+
+    # procesar_registros agrupa por usuario; comparar en el orden de entrada
+    en_orden = copy.deepcopy(registros)
+    procesar_registros(en_orden)
+    if [NOMBRES_TIPO[t] for t in lote.tipo] != [r['tipo'] for r in en_orden]:
+        print("Clasificación del lote: distinta")
+        return 1
+
+    if args.sin_anterior:
+        return 0
+
+    t_anterior, resultado_anterior, parseos = medir(procesar_registros_anterior, registros)
+    print(f"Anterior: {t_anterior:8.3f} s, {parseos} timestamps parseados")
+    print(f"Mejora:   {t_anterior / t_actual:8.1f}x")
+
+    iguales = resultado_actual == resultado_anterior
+    print(f"Resultados idénticos: {'sí' if iguales else 'NO'}")
+    return 0 if iguales else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Consulta del log estructurado (biometrico_sync.jsonl, ver src/log_estructurado.py)
+#
+# Indexa las líneas JSON del log y sus rotaciones (.jsonl.1, .jsonl.2, ...)
+# en una base SQLite junto al log y responde consultas sobre ella. La
+# indexación es incremental: de cada archivo se recuerda hasta dónde se leyó,
+# identificándolo por su primera línea para no volver a indexarlo cuando la
+# rotación le cambia el nombre.
+#
+# Uso:
+#   python scripts/consultar_logs.py --ciclos-lentos [--dias 7] [--limite 10]
+#   python scripts/consultar_logs.py --ciclo 20260101-060000-3
+#   python scripts/consultar_logs.py --errores [--dias 1]
+
+import os
+import sys
+import glob
+import json
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+LOG_DIR_DEFECTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'logs')
+NOMBRE_LOG = 'biometrico_sync.jsonl'
+
+
+def abrir_indice(ruta):
+    db = sqlite3.connect(ruta)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS lineas (
+            ts TEXT, nivel TEXT, ciclo TEXT, dispositivo TEXT,
+            etapa TEXT, duracion REAL, mensaje TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_lineas_ts ON lineas(ts);
+        CREATE INDEX IF NOT EXISTS idx_lineas_ciclo ON lineas(ciclo);
+        CREATE INDEX IF NOT EXISTS idx_lineas_etapa ON lineas(etapa, duracion);
+        CREATE TABLE IF NOT EXISTS archivos (
+            identidad TEXT PRIMARY KEY, posicion INTEGER
+        );
+    """)
+    return db
+
+
+def indexar(db, log_dir):
+    """Agrega al índice las líneas nuevas de los archivos del log"""
+    nuevas = 0
+    # Del más antiguo (.jsonl.5) al actual (.jsonl)
+    archivos = sorted(glob.glob(os.path.join(log_dir, NOMBRE_LOG + '*')),
+                      key=lambda a: -int(a.rsplit('.', 1)[1]) if a[-1].isdigit() else 0)
+    for archivo in archivos:
+        with open(archivo, 'rb') as f:
+            identidad = f.readline().decode('utf-8', errors='replace').strip()
+            if not identidad:
+                continue
+            fila = db.execute("SELECT posicion FROM archivos WHERE identidad = ?", (identidad,)).fetchone()
+            f.seek(fila[0] if fila else 0)
+            filas = []
+            posicion = f.tell()
+            for linea in f:
+                if not linea.endswith(b'\n'):
+                    break  # Línea a medio escribir: se lee en la próxima indexación
+                posicion += len(linea)
+                try:
+                    d = json.loads(linea)
+                except ValueError:
+                    continue
+                filas.append((d.get('ts'), d.get('nivel'), d.get('ciclo'), d.get('dispositivo'),
+                              d.get('etapa'), d.get('duracion'), d.get('mensaje')))
+        db.executemany("INSERT INTO lineas VALUES (?, ?, ?, ?, ?, ?, ?)", filas)
+        db.execute("INSERT OR REPLACE INTO archivos VALUES (?, ?)", (identidad, posicion))
+        nuevas += len(filas)
+    db.commit()
+    return nuevas
+
+
+def ciclos_lentos(db, dias, limite):
+    desde = (datetime.now() - timedelta(days=dias)).isoformat()
+    return db.execute("""
+        SELECT ts, ciclo, duracion FROM lineas
+        WHERE etapa = 'ciclo' AND duracion IS NOT NULL AND ts >= ?
+        ORDER BY duracion DESC LIMIT ?
+    """, (desde, limite)).fetchall()
+
+
+def lineas_ciclo(db, ciclo):
+    return db.execute("""
+        SELECT ts, nivel, dispositivo, etapa, duracion, mensaje FROM lineas
+        WHERE ciclo = ? ORDER BY ts
+    """, (ciclo,)).fetchall()
+
+
+def errores(db, dias):
+    desde = (datetime.now() - timedelta(days=dias)).isoformat()
+    return db.execute("""
+        SELECT ts, nivel, ciclo, dispositivo, etapa, duracion, mensaje FROM lineas
+        WHERE ts >= ? AND nivel IN ('WARNING', 'ERROR', 'CRITICAL') ORDER BY ts
+    """, (desde,)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consulta del log estructurado')
+    parser.add_argument('--log-dir', default=LOG_DIR_DEFECTO, help='Directorio de logs')
+    consulta = parser.add_mutually_exclusive_group(required=True)
+    consulta.add_argument('--ciclos-lentos', action='store_true', help='Ciclos de mayor duración')
+    consulta.add_argument('--ciclo', help='Todas las líneas de un ciclo')
+    consulta.add_argument('--errores', action='store_true', help='Advertencias y errores')
+    parser.add_argument('--dias', type=float, default=7)
+    parser.add_argument('--limite', type=int, default=10)
+    args = parser.parse_args()
+
+    log_dir = os.path.abspath(args.log_dir)
+    if not glob.glob(os.path.join(log_dir, NOMBRE_LOG + '*')):
+        print(f"No hay log estructurado en {log_dir} (activar LOG_JSON en la configuración)")
+        return 1
+
+    db = abrir_indice(os.path.join(log_dir, 'biometrico_sync.idx.db'))
+    nuevas = indexar(db, log_dir)
+    print(f"Índice actualizado: {nuevas} línea(s) nueva(s)\n")
+
+    if args.ciclos_lentos:
+        for ts, ciclo, duracion in ciclos_lentos(db, args.dias, args.limite):
+            print(f"{duracion:9.2f} s  {ciclo}  ({ts})")
+            # Desglose por etapa y dispositivo del ciclo
+            for _, _, dispositivo, etapa, d, _ in lineas_ciclo(db, ciclo):
+                if d is not None and etapa != 'ciclo':
+                    print(f"           {d:9.2f} s  {etapa or '-'}  {dispositivo or ''}")
+    elif args.ciclo:
+        for ts, nivel, dispositivo, etapa, duracion, mensaje in lineas_ciclo(db, args.ciclo):
+            extra = f" [{duracion:.2f} s]" if duracion is not None else ""
+            print(f"{ts} {nivel:<8} {etapa or '-':<14} {dispositivo or '-':<22} {mensaje}{extra}")
+    else:
+        for ts, nivel, ciclo, dispositivo, etapa, _, mensaje in errores(db, args.dias):
+            print(f"{ts} {nivel:<8} {ciclo or '-'} {etapa or '-'} {dispositivo or '-'} {mensaje}")
+    db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
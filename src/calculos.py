@@ -1,15 +1,36 @@
-from datetime import datetime
+from utils import FechasRegistros
 
-def calcular_horas_usuario(user_id, registros):
+def calcular_horas_usuario(user_id, registros, fechas=None):
     registros_usuario = [r for r in registros if r['user_id'] == user_id]
-    registros_usuario.sort(key=lambda x: x['timestamp'])
+    return _calcular_horas(user_id, registros_usuario, FechasRegistros() if fechas is None else fechas)
+
+def calcular_horas_todos(registros, fechas=None):
+    """
+    Calcula las horas de todos los usuarios agrupando los registros una sola
+    vez. Devuelve {user_id: resultado}, con el mismo resultado que
+    calcular_horas_usuario para cada usuario. `fechas` (FechasRegistros)
+    permite reutilizar los timestamps parseados en procesar_registros.
+    """
+    registros_por_usuario = {}
+    for r in registros:
+        registros_por_usuario.setdefault(r['user_id'], []).append(r)
+
+    fechas = FechasRegistros() if fechas is None else fechas
+    return {
+        user_id: _calcular_horas(user_id, registros_usuario, fechas)
+        for user_id, registros_usuario in registros_por_usuario.items()
+    }
+
+def _calcular_horas(user_id, registros_usuario, fechas):
+    """Empareja Entrada/Salida de los registros de un usuario y suma las horas"""
+    registros_usuario.sort(key=fechas.epoca)
 
     entrada = None
     total_horas = 0
     detalle = []
 
     for reg in registros_usuario:
-        timestamp = datetime.fromisoformat(reg['timestamp'])
+        timestamp = fechas.fecha(reg)
 
         if reg.get('tipo') == 'Entrada':
             entrada = timestamp
@@ -30,16 +51,23 @@ def calcular_horas_usuario(user_id, registros):
         'detalle': detalle
     }
 
-def determinar_tipo_registro(registro, registros_usuario):
+def determinar_tipo_registro(registro, registros_usuario, fechas=None):
     """
     Determina si el registro actual es una entrada o una salida
-    basándose en el último tipo de registro previo.
+    basándose en el último tipo de registro previo. Pasar la misma `fechas`
+    (FechasRegistros) en llamadas sucesivas evita volver a parsear el
+    historial del usuario en cada una.
     """
-    registros_anteriores = [r for r in registros_usuario if r['timestamp'] < registro['timestamp']]
-    registros_anteriores.sort(key=lambda r: r['timestamp'], reverse=True)
+    fechas = FechasRegistros() if fechas is None else fechas
+    epoca = fechas.epoca(registro)
+    anterior = None  # El de mayor timestamp menor al del registro; ante empate, el primero
+    epoca_anterior = None
+    for r in registros_usuario:
+        epoca_r = fechas.epoca(r)
+        if epoca_r < epoca and (anterior is None or epoca_r > epoca_anterior):
+            anterior, epoca_anterior = r, epoca_r
 
-    if not registros_anteriores:
+    if anterior is None:
         return 'Entrada'  # No hay registros previos
 
-    ultimo_tipo = registros_anteriores[0]['tipo']
-    return 'Salida' if ultimo_tipo == 'Entrada' else 'Entrada'
\ No newline at end of file
+    return 'Salida' if anterior['tipo'] == 'Entrada' else 'Entrada'
\ No newline at end of file
@@ -0,0 +1,95 @@
+# circuito.py
+"""
+Interruptor de circuito para los envíos al servidor
+===================================================
+Evita insistir contra un servidor caído. Tras varios fallos seguidos el
+circuito se abre y durante un tiempo no se intenta ningún envío: los
+registros siguen entrando a la cola local y se envían cuando vuelve.
+
+Estados:
+- cerrado: los envíos se hacen normalmente.
+- abierto: no se envía nada hasta que pasa la espera.
+- semiabierto: pasada la espera se sondea el servidor; si responde se
+  intenta el envío, y el resultado cierra o vuelve a abrir el circuito.
+
+La espera crece exponencialmente con cada apertura consecutiva, con una
+parte aleatoria (jitter) para que varios equipos no reintenten a la vez.
+"""
+
+import time
+import random
+import logging
+import threading
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+
+class InterruptorCircuito:
+    """Estado del circuito de envíos, seguro entre hilos"""
+
+    def __init__(self, umbral_fallos=3, espera_base=30, espera_maxima=1800):
+        self.umbral_fallos = max(1, int(umbral_fallos))
+        self.espera_base = float(espera_base)
+        self.espera_maxima = float(espera_maxima)
+        self.estado = CERRADO
+        self.fallos_consecutivos = 0
+        self.aperturas = 0  # Aperturas seguidas sin un envío exitoso en medio
+        self.abierto_hasta = 0
+        self._lock = threading.Lock()
+
+    def permite_intento(self):
+        """
+        Indica si se puede intentar un envío. Al vencer la espera de un
+        circuito abierto pasa a semiabierto y permite un intento.
+        """
+        with self._lock:
+            if self.estado == ABIERTO:
+                if time.time() < self.abierto_hasta:
+                    return False
+                self.estado = SEMIABIERTO
+                logging.info("CIRCUIT: Espera cumplida, circuito semiabierto: se probará el servidor")
+            return True
+
+    def registrar_exito(self):
+        with self._lock:
+            if self.estado != CERRADO:
+                logging.info("CIRCUIT: El servidor respondió, circuito cerrado")
+            self.estado = CERRADO
+            self.fallos_consecutivos = 0
+            self.aperturas = 0
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos_consecutivos += 1
+            if self.estado == ABIERTO:
+                return  # Envíos que ya estaban en curso al abrirse: no alargan la espera
+            if self.estado == SEMIABIERTO or self.fallos_consecutivos >= self.umbral_fallos:
+                self._abrir()
+
+    def _abrir(self):
+        espera = min(self.espera_maxima, self.espera_base * (2 ** self.aperturas))
+        espera = espera / 2 + random.uniform(0, espera / 2)
+        self.aperturas += 1
+        self.estado = ABIERTO
+        self.abierto_hasta = time.time() + espera
+        logging.warning(f"CIRCUIT: Circuito abierto tras {self.fallos_consecutivos} fallo(s) seguidos, "
+                        f"no se enviará al servidor durante {espera:.0f} segundos")
+
+    def segundos_restantes(self):
+        """Segundos hasta el próximo intento si el circuito está abierto"""
+        with self._lock:
+            if self.estado != ABIERTO:
+                return 0
+            return max(0, self.abierto_hasta - time.time())
+
+    def resumen(self):
+        """Estado actual para diagnóstico"""
+        with self._lock:
+            return {
+                'estado': self.estado,
+                'fallos_consecutivos': self.fallos_consecutivos,
+                'aperturas': self.aperturas,
+                'segundos_restantes': max(0, self.abierto_hasta - time.time()) if self.estado == ABIERTO else 0,
+            }
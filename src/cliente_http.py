@@ -0,0 +1,216 @@
+# cliente_http.py
+"""
+Cliente HTTP compartido
+=======================
+Sesión `requests` única por proceso para todos los envíos al servidor.
+
+Mantiene las conexiones abiertas (keep-alive) en un pool, de modo que los
+envíos sucesivos reutilizan la misma conexión TCP/TLS en lugar de abrir una
+nueva en cada petición. Los contadores de conexiones permiten comprobar
+cuántas peticiones reutilizaron una conexión existente.
+
+El pool de conexiones por host se ajusta al número de envíos en paralelo
+(HILOS_ENVIO, ver configurar_pool), con un tope: más hilos que conexiones
+abrirían conexiones que se cierran al terminar cada petición.
+
+Opcionalmente comprime el cuerpo de las peticiones (gzip, o zstd si el
+módulo `zstandard` está instalado). Si el servidor responde 415 a un cuerpo
+comprimido, se reenvía sin comprimir y esa URL deja de comprimirse.
+"""
+
+import gzip
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+POOL_HOSTS = 4  # Número de hosts distintos con pool propio
+POOL_CONEXIONES_POR_HOST = 8  # Conexiones abiertas que se conservan por host, como mínimo
+POOL_CONEXIONES_MAXIMO = 32  # Tope de conexiones por host, y de envíos en paralelo
+USER_AGENT = "SincronizadorBiometrico/3.2"
+
+_sesion = None
+_sesion_lock = threading.Lock()
+_tamano_pool = POOL_CONEXIONES_POR_HOST
+_pools_cerrados = {'conexiones_nuevas': 0, 'peticiones_pool': 0}  # De adaptadores reemplazados
+_contadores = {'peticiones': 0, 'errores': 0, 'bytes_json': 0, 'bytes_enviados': 0}
+_contadores_lock = threading.Lock()
+_urls_sin_compresion = set()  # URLs que rechazaron cuerpos comprimidos (HTTP 415)
+
+
+def obtener_sesion():
+    """Devuelve la sesión HTTP compartida del proceso, creándola la primera vez"""
+    global _sesion
+    with _sesion_lock:
+        if _sesion is None:
+            sesion = requests.Session()
+            _montar_adaptador(sesion, _tamano_pool)
+            sesion.headers.update({
+                'User-Agent': USER_AGENT,
+                'Connection': 'keep-alive',
+            })
+            _sesion = sesion
+            logging.info("HTTP: Sesión compartida creada (keep-alive, "
+                         f"{_tamano_pool} conexiones por host)")
+        return _sesion
+
+
+def _montar_adaptador(sesion, tamano):
+    adaptador = HTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=tamano,
+        max_retries=0,
+    )
+    sesion.mount('http://', adaptador)
+    sesion.mount('https://', adaptador)
+
+
+def configurar_pool(hilos):
+    """
+    Ajusta las conexiones por host a `hilos` envíos en paralelo, entre
+    POOL_CONEXIONES_POR_HOST y POOL_CONEXIONES_MAXIMO. Devuelve cuántos envíos
+    en paralelo admite el pool. Llamar sin envíos en curso: el adaptador
+    anterior se cierra.
+    """
+    global _tamano_pool
+    tamano = min(max(hilos, POOL_CONEXIONES_POR_HOST), POOL_CONEXIONES_MAXIMO)
+    with _sesion_lock:
+        if tamano != _tamano_pool:
+            _tamano_pool = tamano
+            if _sesion is not None:
+                anterior = _sesion.get_adapter('https://')
+                conexiones, peticiones = _contar_pools(anterior)
+                with _contadores_lock:
+                    _pools_cerrados['conexiones_nuevas'] += conexiones
+                    _pools_cerrados['peticiones_pool'] += peticiones
+                _montar_adaptador(_sesion, tamano)
+                anterior.close()
+            logging.info(f"HTTP: Pool de {tamano} conexiones por host")
+    return min(hilos, POOL_CONEXIONES_MAXIMO)
+
+
+def resolver_compresion(compresion):
+    """Normaliza el algoritmo configurado; zstd cae a gzip si no está disponible"""
+    compresion = (compresion or '').strip().lower()
+    if compresion == 'zstd' and not ZSTD_AVAILABLE:
+        return 'gzip'
+    if compresion in ('gzip', 'zstd'):
+        return compresion
+    return None
+
+
+def comprimir(cuerpo, compresion):
+    """Comprime un cuerpo en bytes con el algoritmo indicado"""
+    if compresion == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(cuerpo)
+    return gzip.compress(cuerpo, compresslevel=6)
+
+
+def post_json(url, datos, headers=None, timeout=30, compresion=None, umbral_compresion=1024):
+    """
+    Envía `datos` como JSON usando la sesión compartida.
+    Con `compresion` ('gzip' o 'zstd') el cuerpo se comprime cuando supera
+    `umbral_compresion` bytes; por debajo se envía JSON plano.
+    """
+    headers = dict(headers or {})
+    headers['Content-Type'] = 'application/json'
+    cuerpo = json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    algoritmo = resolver_compresion(compresion)
+    if algoritmo and (url in _urls_sin_compresion or len(cuerpo) < umbral_compresion):
+        algoritmo = None
+
+    with _contadores_lock:
+        _contadores['peticiones'] += 1
+    try:
+        if algoritmo:
+            comprimido = comprimir(cuerpo, algoritmo)
+            headers_comprimido = dict(headers, **{'Content-Encoding': algoritmo})
+            resp = obtener_sesion().post(url, data=comprimido, headers=headers_comprimido, timeout=timeout)
+            if resp.status_code != 415:
+                _contar_bytes(len(cuerpo), len(comprimido))
+                return resp
+            # El servidor no acepta cuerpos comprimidos: recordar y reenviar plano
+            logging.warning(f"HTTP: El servidor rechazó Content-Encoding {algoritmo}, se enviará sin comprimir")
+            _urls_sin_compresion.add(url)
+            _contar_bytes(len(cuerpo), len(comprimido))
+            with _contadores_lock:
+                _contadores['peticiones'] += 1  # El reenvío es otra petición
+
+        resp = obtener_sesion().post(url, data=cuerpo, headers=headers, timeout=timeout)
+        _contar_bytes(len(cuerpo), len(cuerpo))
+        return resp
+    except Exception:
+        with _contadores_lock:
+            _contadores['errores'] += 1
+        raise
+
+
+def sondear(url, timeout=5):
+    """
+    Comprueba si el servidor responde, con una petición HEAD corta. Cualquier
+    respuesta por debajo de 500 (aunque sea 404 o 405) indica que está activo.
+    """
+    try:
+        resp = obtener_sesion().head(url, timeout=timeout, allow_redirects=False)
+        return resp.status_code < 500
+    except Exception as e:
+        logging.info(f"HTTP: El servidor no responde al sondeo: {e}")
+        return False
+
+
+def _contar_bytes(bytes_json, bytes_enviados):
+    with _contadores_lock:
+        _contadores['bytes_json'] += bytes_json
+        _contadores['bytes_enviados'] += bytes_enviados
+
+
+def estadisticas_conexiones():
+    """
+    Devuelve los contadores de uso de conexiones de la sesión compartida:
+    peticiones enviadas, conexiones nuevas abiertas y peticiones que
+    reutilizaron una conexión existente.
+    """
+    with _contadores_lock:
+        stats = dict(_contadores)
+        stats.update(_pools_cerrados)
+
+    sesion = _sesion
+    if sesion is not None:
+        for adaptador in {id(a): a for a in sesion.adapters.values()}.values():
+            conexiones, peticiones = _contar_pools(adaptador)
+            stats['conexiones_nuevas'] += conexiones
+            stats['peticiones_pool'] += peticiones
+
+    stats['reutilizadas'] = max(0, stats['peticiones_pool'] - stats['conexiones_nuevas'])
+    return stats
+
+
+def _contar_pools(adaptador):
+    """Conexiones abiertas y peticiones hechas por los pools de un adaptador"""
+    conexiones = peticiones = 0
+    pools = adaptador.poolmanager.pools
+    for clave in list(pools.keys()):
+        pool = pools.get(clave)
+        if pool is None:
+            continue
+        conexiones += getattr(pool, 'num_connections', 0)
+        peticiones += getattr(pool, 'num_requests', 0)
+    return conexiones, peticiones
+
+
+def cerrar_sesion():
+    """Cierra la sesión compartida y sus conexiones abiertas"""
+    global _sesion
+    with _sesion_lock:
+        if _sesion is not None:
+            _sesion.close()
+            _sesion = None
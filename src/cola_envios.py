@@ -0,0 +1,295 @@
+# cola_envios.py
+"""
+Cola local de envíos (outbox)
+=============================
+Base de datos SQLite en modo WAL donde se guardan los registros leídos del
+dispositivo hasta que el servidor confirma su recepción.
+
+La lectura del dispositivo solo agrega registros a la cola; el envío los toma
+por lotes y los marca como confirmados cuando el servidor responde OK. Los
+registros confirmados se conservan como archivo local.
+
+Un registro que el servidor rechaza (4xx) MAX_INTENTOS_ENVIO veces pasa a
+descartado: deja de enviarse para no bloquear a los que vienen detrás, y
+queda en la base hasta que se reintente con reintentar_descartados().
+
+Un índice único por (dispositivo, user_id, timestamp, punch) descarta al
+encolar las marcaciones que ya pasaron por la cola, antes de serializarlas.
+
+Retención: los registros confirmados y las claves del índice de marcaciones
+de más de RETENCION_COLA_DIAS días se eliminan, para que la base no crezca
+sin límite. El índice cubre así solo los días recientes; la lectura del
+dispositivo trata las marcaciones anteriores a ese plazo como archivadas y no
+las encola (ver inicio_retencion), aunque sigan en el dispositivo.
+"""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+
+def _formato_envio(registro):
+    para_envio = getattr(registro, 'para_envio', None)
+    return para_envio() if para_envio else registro
+
+
+RETENCION_CADA_SEGUNDOS = 3600  # La retención se aplica como máximo una vez por hora
+
+
+def inicio_retencion(dias):
+    """
+    Timestamp ISO a partir del cual se conservan las marcaciones. La lectura
+    del dispositivo ignora las anteriores, cuyas claves ya no están en el índice.
+    """
+    return (datetime.now() - timedelta(days=dias)).isoformat()
+
+
+class ColaEnvios:
+    """Cola persistente de registros pendientes de enviar al servidor"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._consultados = 0  # Registros que pasaron por el índice de duplicados
+        self._duplicados = 0  # Registros descartados por estar ya en el índice
+        self._ultima_retencion = 0
+        self._crear_tablas()
+
+    def _crear_tablas(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS registros (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    dispositivo TEXT NOT NULL,
+                    datos TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    enviado REAL
+                )
+            """)
+            columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(registros)")}
+            if 'rechazos' not in columnas:
+                self._conn.execute("ALTER TABLE registros ADD COLUMN rechazos INTEGER NOT NULL DEFAULT 0")
+            if 'descartado' not in columnas:
+                self._conn.execute("ALTER TABLE registros ADD COLUMN descartado REAL")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_registros_pendientes ON registros (enviado, id)"
+            )
+            existia_indice = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'indice_registros'"
+            ).fetchone()
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS indice_registros (
+                    id INTEGER PRIMARY KEY,
+                    dispositivo TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    timestamp TEXT,
+                    punch INTEGER NOT NULL,
+                    UNIQUE (dispositivo, user_id, timestamp, punch)
+                )
+            """)
+            if not existia_indice:
+                self._indexar_existentes()
+            else:
+                # Un timestamp NULL no se compara en UNIQUE: esas claves no detectaban duplicados
+                self._conn.execute("UPDATE OR IGNORE indice_registros SET timestamp = '' WHERE timestamp IS NULL")
+                self._conn.execute("DELETE FROM indice_registros WHERE timestamp IS NULL")
+
+    def _indexar_existentes(self):
+        """Agrega al índice de duplicados los registros encolados antes de que existiera"""
+        try:
+            self._conn.execute("""
+                INSERT OR IGNORE INTO indice_registros (dispositivo, user_id, timestamp, punch)
+                SELECT dispositivo, CAST(json_extract(datos, '$.user_id') AS TEXT),
+                       COALESCE(json_extract(datos, '$.timestamp'), ''), COALESCE(json_extract(datos, '$.punch'), 0)
+                FROM registros ORDER BY id
+            """)
+        except sqlite3.Error as e:
+            logging.warning(f"OUTBOX: No se pudieron indexar los registros existentes: {e}")
+
+    def encolar(self, dispositivo, registros):
+        """
+        Agrega registros a la cola en una sola transacción; devuelve cuántos se
+        agregaron. Acepta diccionarios u objetos con para_envio(), en una lista
+        o en un generador (se insertan a medida que llegan, sin acumularlos).
+        Los registros que ya pasaron por la cola se descartan sin serializarlos.
+        Si el generador falla, la transacción se revierte completa.
+        """
+        ahora = time.time()
+        agregados = 0
+        duplicados = 0
+        with self._lock, self._conn:
+            for r in registros:
+                datos = _formato_envio(r)
+                nuevo = self._conn.execute(
+                    "INSERT OR IGNORE INTO indice_registros (dispositivo, user_id, timestamp, punch) "
+                    "VALUES (?, ?, ?, ?)",
+                    (dispositivo, str(datos['user_id']), datos.get('timestamp') or '', datos.get('punch') or 0)
+                ).rowcount
+                if not nuevo:
+                    duplicados += 1
+                    continue
+                self._conn.execute(
+                    "INSERT INTO registros (dispositivo, datos, creado) VALUES (?, ?, ?)",
+                    (dispositivo, json.dumps(datos, ensure_ascii=False), ahora)
+                )
+                agregados += 1
+            self._consultados += agregados + duplicados
+            self._duplicados += duplicados
+        if duplicados:
+            logging.info(f"OUTBOX: {duplicados} registros duplicados descartados")
+        return agregados
+
+    def obtener_pendientes(self, limite, dispositivo=None):
+        """
+        Devuelve hasta `limite` registros pendientes como lista de (id, registro).
+        Los que el servidor ya rechazó van al final, detrás de los nuevos.
+        """
+        consulta = "SELECT id, datos FROM registros WHERE enviado IS NULL AND descartado IS NULL"
+        parametros = []
+        if dispositivo is not None:
+            consulta += " AND dispositivo = ?"
+            parametros.append(dispositivo)
+        consulta += " ORDER BY rechazos, id LIMIT ?"
+        parametros.append(limite)
+        with self._lock:
+            filas = self._conn.execute(consulta, parametros).fetchall()
+        return [(fila[0], json.loads(fila[1])) for fila in filas]
+
+    def confirmar(self, ids):
+        """Marca como enviados los registros confirmados por el servidor"""
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE registros SET enviado = ? WHERE id = ?", [(ahora, i) for i in ids]
+            )
+
+    def registrar_fallo(self, ids):
+        """Incrementa el contador de intentos de registros cuyo envío falló"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE registros SET intentos = intentos + 1 WHERE id = ?", [(i,) for i in ids]
+            )
+
+    def registrar_rechazo(self, ids, maximo_intentos):
+        """
+        Registra que el servidor rechazó estos registros y descarta los que ya
+        llegaron a `maximo_intentos` rechazos. Devuelve cuántos se descartaron.
+        """
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE registros SET intentos = intentos + 1, rechazos = rechazos + 1 WHERE id = ?",
+                [(i,) for i in ids]
+            )
+            descartados = 0
+            for i in ids:
+                descartados += self._conn.execute(
+                    "UPDATE registros SET descartado = ? WHERE id = ? AND rechazos >= ? AND descartado IS NULL",
+                    (ahora, i, maximo_intentos)
+                ).rowcount
+        if descartados:
+            logging.warning(f"OUTBOX: {descartados} registros descartados tras {maximo_intentos} rechazos del servidor")
+        return descartados
+
+    def contar_descartados(self, dispositivo=None):
+        """Número de registros descartados por rechazos repetidos del servidor"""
+        consulta = "SELECT COUNT(*) FROM registros WHERE enviado IS NULL AND descartado IS NOT NULL"
+        parametros = []
+        if dispositivo is not None:
+            consulta += " AND dispositivo = ?"
+            parametros.append(dispositivo)
+        with self._lock:
+            return self._conn.execute(consulta, parametros).fetchone()[0]
+
+    def reintentar_descartados(self, dispositivo=None):
+        """Vuelve a poner en la cola los registros descartados; devuelve cuántos"""
+        consulta = "UPDATE registros SET descartado = NULL, rechazos = 0 WHERE descartado IS NOT NULL"
+        parametros = []
+        if dispositivo is not None:
+            consulta += " AND dispositivo = ?"
+            parametros.append(dispositivo)
+        with self._lock, self._conn:
+            return self._conn.execute(consulta, parametros).rowcount
+
+    def contar_pendientes(self, dispositivo=None):
+        """Número de registros aún no confirmados por el servidor (sin los descartados)"""
+        consulta = "SELECT COUNT(*) FROM registros WHERE enviado IS NULL AND descartado IS NULL"
+        parametros = []
+        if dispositivo is not None:
+            consulta += " AND dispositivo = ?"
+            parametros.append(dispositivo)
+        with self._lock:
+            return self._conn.execute(consulta, parametros).fetchone()[0]
+
+    def contar_no_archivados(self, dispositivo, claves, archivados_hasta=None):
+        """
+        Cuántas de las claves (user_id, timestamp, punch) de un dispositivo no
+        están en la cola. Junto con contar_pendientes() == 0 permite comprobar
+        que todas fueron confirmadas por el servidor. Las claves con timestamp
+        hasta `archivados_hasta` (inclusive) se dan por archivadas: la
+        retención puede haberlas quitado ya del índice.
+        """
+        faltantes = 0
+        with self._lock:
+            for user_id, timestamp, punch in claves:
+                if archivados_hasta and timestamp and timestamp <= archivados_hasta:
+                    continue
+                existe = self._conn.execute(
+                    "SELECT 1 FROM indice_registros WHERE dispositivo = ? AND user_id = ? "
+                    "AND timestamp = ? AND punch = ?",
+                    (dispositivo, str(user_id), timestamp, punch or 0)
+                ).fetchone()
+                if not existe:
+                    faltantes += 1
+        return faltantes
+
+    def aplicar_retencion(self, dias):
+        """
+        Elimina los registros confirmados hace más de `dias` días y las claves
+        del índice de marcaciones anteriores a ese plazo. Los pendientes y los
+        descartados se conservan. Se ejecuta como máximo una vez por hora;
+        devuelve (registros, claves) eliminados.
+        """
+        ahora = time.time()
+        if not dias or ahora - self._ultima_retencion < RETENCION_CADA_SEGUNDOS:
+            return 0, 0
+        self._ultima_retencion = ahora
+        with self._lock, self._conn:
+            registros = self._conn.execute(
+                "DELETE FROM registros WHERE enviado IS NOT NULL AND enviado < ?", (ahora - dias * 86400,)
+            ).rowcount
+            claves = self._conn.execute(
+                "DELETE FROM indice_registros WHERE timestamp < ? AND timestamp != ''", (inicio_retencion(dias),)
+            ).rowcount
+        if registros or claves:
+            logging.info(f"OUTBOX: Retención de {dias} días: {registros} registros confirmados "
+                         f"y {claves} claves del índice eliminados")
+        return registros, claves
+
+    def estadisticas_duplicados(self):
+        """
+        Registros consultados y descartados por el índice de duplicados desde
+        que se abrió la cola, y número de registros en el índice.
+        """
+        with self._lock:
+            tamano = self._conn.execute("SELECT COUNT(*) FROM indice_registros").fetchone()[0]
+            return {
+                'consultados': self._consultados,
+                'duplicados': self._duplicados,
+                'tamano_indice': tamano,
+            }
+
+    def cerrar(self):
+        """Cierra la conexión con la base de datos"""
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception as e:
+                logging.warning(f"OUTBOX: Error cerrando la cola: {e}")
@@ -0,0 +1,181 @@
+# estado_dispositivos.py
+"""
+Estado persistente por dispositivo
+==================================
+Guarda en un archivo JSON la información que debe sobrevivir entre ciclos
+de sincronización para cada biométrico, indexada por "ip:puerto".
+
+Se usa para la marca de agua (high-water mark) de los registros ya
+guardados, de forma que cada ciclo solo envíe los registros nuevos, y para
+recordar la estrategia de conexión que funcionó con cada dispositivo.
+"""
+
+import os
+import copy
+import json
+import logging
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+from utils import parsear_timestamp
+
+
+def clave_dispositivo(ip, puerto):
+    """Clave única con la que se indexa el estado de un dispositivo"""
+    return f"{ip}:{puerto}"
+
+
+def identidad_registro(user_id, punch, status):
+    """Identidad de un registro dentro de un mismo timestamp"""
+    return [str(user_id), punch, status]
+
+
+class EstadoDispositivos:
+    """Archivo JSON con el estado de cada dispositivo, seguro entre hilos"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._datos = self._cargar()
+
+    def _cargar(self):
+        """Carga el estado desde disco; si no existe o está dañado empieza vacío"""
+        if not os.path.exists(self.ruta):
+            return {}
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            if isinstance(datos, dict):
+                return datos
+            logging.warning(f"STATE: Formato inesperado en {self.ruta}, se reinicia el estado")
+        except Exception as e:
+            logging.warning(f"STATE: Error leyendo {self.ruta}: {e}")
+        return {}
+
+    def _guardar(self):
+        """Escribe el estado en un archivo temporal y lo reemplaza de forma atómica"""
+        temp_path = self.ruta + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._datos, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, self.ruta)
+            return True
+        except Exception as e:
+            logging.error(f"STATE: No se pudo guardar el estado en {self.ruta}: {e}")
+            try:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+
+    def obtener(self, clave, campo, defecto=None):
+        """Devuelve una copia de un campo del estado de un dispositivo"""
+        with self._lock:
+            return copy.deepcopy(self._datos.get(clave, {}).get(campo, defecto))
+
+    def actualizar(self, clave, campo, valor):
+        """Actualiza un campo del estado de un dispositivo y lo persiste"""
+        with self._lock:
+            self._datos.setdefault(clave, {})[campo] = valor
+            return self._guardar()
+
+    def actualizar_campos(self, clave, campos):
+        """Actualiza varios campos del estado de un dispositivo con una sola escritura"""
+        with self._lock:
+            self._datos.setdefault(clave, {}).update(campos)
+            return self._guardar()
+
+    def eliminar(self, clave, campo):
+        """Elimina un campo del estado de un dispositivo y lo persiste"""
+        with self._lock:
+            if campo in self._datos.get(clave, {}):
+                del self._datos[clave][campo]
+                return self._guardar()
+            return True
+
+
+# ————— Marca de agua (última subida confirmada) —————
+@lru_cache(maxsize=64)
+def _fecha_marca(timestamp):
+    """Timestamp de una marca de agua como datetime; se parsea una vez por marca"""
+    return parsear_timestamp(timestamp)
+
+
+def es_posterior_a_marca(timestamp, identidad, marca):
+    """
+    Indica si un registro es posterior a la marca de agua.
+    Un registro con el mismo timestamp que la marca solo se considera nuevo
+    si su identidad no estaba entre los registros ya subidos en ese instante.
+    """
+    if not marca or not marca.get('timestamp'):
+        return True
+    if timestamp is None:
+        return False
+
+    marca_ts = _fecha_marca(marca['timestamp'])
+    if timestamp > marca_ts:
+        return True
+    if timestamp < marca_ts:
+        return False
+    return identidad not in marca.get('identidades', [])
+
+
+def _fecha_e_identidad(registro):
+    """Fecha e identidad de un registro, sea diccionario o RegistroAsistencia"""
+    if isinstance(registro, dict):
+        fecha = parsear_timestamp(registro['timestamp']) if registro.get('timestamp') else None
+        return fecha, identidad_registro(registro['user_id'], registro.get('punch', 0), registro.get('status'))
+    return registro.fecha, identidad_registro(registro.user_id, registro.punch, registro.status)
+
+
+class AcumuladorMarca:
+    """
+    Calcula la nueva marca de agua registro a registro, para poder hacerlo
+    mientras los registros fluyen hacia la cola sin guardarlos en una lista.
+    Guarda el timestamp más reciente y la identidad de todos los registros
+    con ese timestamp, para no reenviarlos ni perder otros del mismo segundo.
+    """
+
+    def __init__(self, marca_anterior=None):
+        self.marca_anterior = marca_anterior
+        self.timestamp = (marca_anterior or {}).get('timestamp')
+        self.identidades = list((marca_anterior or {}).get('identidades', []))
+        self._fecha = _fecha_marca(self.timestamp) if self.timestamp else None
+
+    def agregar(self, registro):
+        ts, identidad = _fecha_e_identidad(registro)
+        if ts is None:
+            return
+        if self._fecha is None or ts > self._fecha:
+            self._fecha = ts
+            self.timestamp = ts.isoformat()
+            self.identidades = [identidad]
+        elif ts == self._fecha and identidad not in self.identidades:
+            self.identidades.append(identidad)
+
+    def recorrer(self, registros):
+        """Generador que deja pasar los registros acumulando la marca"""
+        for registro in registros:
+            self.agregar(registro)
+            yield registro
+
+    def resultado(self):
+        """Nueva marca de agua, o la anterior si no hubo registros con timestamp"""
+        if self.timestamp is None:
+            return self.marca_anterior
+        return {
+            'timestamp': self.timestamp,
+            'identidades': self.identidades,
+            'actualizada': datetime.now().isoformat(),
+        }
+
+
+def calcular_marca_agua(registros, marca_anterior=None):
+    """Calcula la nueva marca de agua a partir de los registros subidos"""
+    acumulador = AcumuladorMarca(marca_anterior)
+    for registro in registros:
+        acumulador.agregar(registro)
+    return acumulador.resultado()
@@ -12,6 +12,7 @@ import zipfile
 import platform
 import requests
 from pathlib import Path
+from cliente_http import post_json
 import time
 from datetime import datetime
 import tempfile
@@ -1267,7 +1268,7 @@ class InstaladorCompleto:
             self.log_message(f"Enviando {len(datos)} registros al servidor...", self.sync_log_text)
             
             # Enviar directamente la lista de datos como espera el servidor
-            response = requests.post(url, json=datos, headers=headers, timeout=30)
+            response = post_json(url, datos, headers=headers, timeout=30)
             
             self.log_message(f"Código de respuesta: {response.status_code}", self.sync_log_text)
             
@@ -0,0 +1,93 @@
+# log_estructurado.py
+"""
+Log estructurado en JSON lines
+==============================
+Formato opcional del log donde cada línea es un objeto JSON con el ciclo de
+sincronización, el dispositivo y la etapa en que se generó, y la duración
+cuando el mensaje cierra una etapa. Permite consultar el log (por ejemplo,
+los ciclos más lentos de la semana) sin buscar texto con grep; ver
+scripts/consultar_logs.py.
+
+El contexto (ciclo, dispositivo, etapa) se guarda por hilo, así cada hilo de
+lectura de dispositivos etiqueta sus propios mensajes. El ciclo en curso es
+común a todos los hilos.
+"""
+
+import json
+import logging
+import threading
+import itertools
+from datetime import datetime
+
+_contexto = threading.local()
+_ciclo_actual = None
+_contador_ciclos = itertools.count(1)
+
+
+def iniciar_ciclo():
+    """Genera y fija el identificador del ciclo de sincronización en curso"""
+    global _ciclo_actual
+    _ciclo_actual = f"{datetime.now():%Y%m%d-%H%M%S}-{next(_contador_ciclos)}"
+    return _ciclo_actual
+
+
+def fijar_dispositivo(dispositivo):
+    """Dispositivo al que se refieren los mensajes de este hilo (None para quitarlo)"""
+    _contexto.dispositivo = dispositivo
+
+
+def fijar_etapa(etapa):
+    """Etapa (lectura, envío, ...) a la que se refieren los mensajes de este hilo"""
+    _contexto.etapa = etapa
+
+
+_formato_excepcion = logging.Formatter()
+
+
+class FiltroContexto(logging.Filter):
+    """
+    Agrega ciclo, dispositivo y etapa a cada registro de log. Debe correr en
+    el hilo que genera el mensaje (antes de encolarlo), no en el que lo escribe.
+    Los valores pasados con `extra=` tienen prioridad.
+
+    También guarda aparte el traceback, si lo hay: al encolar el registro,
+    QueueHandler lo agrega al mensaje y descarta exc_info.
+    """
+
+    def filter(self, record):
+        if record.exc_info and not hasattr(record, 'excepcion'):
+            record.excepcion = _formato_excepcion.formatException(record.exc_info)
+        if not hasattr(record, 'ciclo'):
+            record.ciclo = _ciclo_actual
+        if not hasattr(record, 'dispositivo'):
+            record.dispositivo = getattr(_contexto, 'dispositivo', None)
+        if not hasattr(record, 'etapa'):
+            record.etapa = getattr(_contexto, 'etapa', None)
+        return True
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro de log"""
+
+    def format(self, record):
+        mensaje = record.getMessage()
+        excepcion = getattr(record, 'excepcion', None)
+        if excepcion is None and record.exc_info:
+            excepcion = self.formatException(record.exc_info)
+        if excepcion and mensaje.endswith('\n' + excepcion):
+            mensaje = mensaje[:-len(excepcion) - 1]  # El traceback va en su propio campo
+        linea = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'ciclo': getattr(record, 'ciclo', None),
+            'dispositivo': getattr(record, 'dispositivo', None),
+            'etapa': getattr(record, 'etapa', None),
+            'hilo': record.threadName,
+            'mensaje': mensaje,
+        }
+        duracion = getattr(record, 'duracion', None)
+        if duracion is not None:
+            linea['duracion'] = round(duracion, 3)
+        if excepcion:
+            linea['excepcion'] = excepcion
+        return json.dumps(linea, ensure_ascii=False)
@@ -0,0 +1,270 @@
+# lote_registros.py
+"""
+Lote columnar de registros de asistencia
+========================================
+Representación compacta de muchas marcaciones para su procesamiento: en
+lugar de una lista de diccionarios con el timestamp en texto ISO, cada campo
+es una columna `array` y los textos repetidos (user_id, nombre, estación) se
+guardan una sola vez en un diccionario y se referencian por código.
+
+El timestamp se convierte a segundos desde 1970 una sola vez al crear el
+lote; clasificar, ordenar, emparejar y calcular horas trabaja sobre números. La
+conversión a diccionarios queda solo en los bordes (lectura y envío).
+
+Los timestamps sin zona se tratan como hora local, igual que los entrega el
+dispositivo. De los que traen zona horaria se guarda además el desfase UTC
+de cada registro, para devolverlos con la misma hora y zona con que
+llegaron.
+"""
+
+import math
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+from utils import EPOCA, parsear_timestamp, epoca_de_fecha
+
+TIPO_SIN_CLASIFICAR = -1
+TIPO_ENTRADA = 0
+TIPO_SALIDA = 1
+NOMBRES_TIPO = {TIPO_ENTRADA: 'Entrada', TIPO_SALIDA: 'Salida'}
+CODIGOS_TIPO = {'Entrada': TIPO_ENTRADA, 'Salida': TIPO_SALIDA}
+
+
+def a_epoca(timestamp):
+    """Convierte un timestamp ISO, datetime o época a segundos desde 1970; None -> NaN"""
+    if timestamp is None:
+        return math.nan
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if isinstance(timestamp, str):
+        timestamp = parsear_timestamp(timestamp)
+    return epoca_de_fecha(timestamp)
+
+
+def desfase_de(timestamp):
+    """Desfase UTC en segundos de un timestamp con zona horaria; NaN si no tiene"""
+    if isinstance(timestamp, str):
+        timestamp = parsear_timestamp(timestamp)
+    if isinstance(timestamp, datetime) and timestamp.tzinfo is not None:
+        return timestamp.utcoffset().total_seconds()
+    return math.nan
+
+
+def desde_epoca(segundos, desfase=math.nan):
+    """
+    Convierte segundos desde 1970 a datetime; NaN -> None. Con desfase el
+    datetime lleva esa zona horaria, como el timestamp original.
+    """
+    if math.isnan(segundos):
+        return None
+    if not math.isnan(desfase):
+        return datetime.fromtimestamp(segundos, timezone(timedelta(seconds=desfase)))
+    return EPOCA + timedelta(seconds=segundos)
+
+
+class _Diccionario:
+    """Valores distintos de una columna de texto, referenciados por código"""
+
+    __slots__ = ('valores', '_codigos')
+
+    def __init__(self, valores=None):
+        self.valores = list(valores or [])
+        self._codigos = {v: i for i, v in enumerate(self.valores)}
+
+    def codificar(self, valor):
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            codigo = self._codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return codigo
+
+
+class LoteRegistros:
+    """Columnas de un conjunto de registros de asistencia"""
+
+    def __init__(self, usuarios=None, nombres=None, estaciones=None):
+        self.usuarios = usuarios or _Diccionario()
+        self.nombres = nombres or _Diccionario()
+        self.estaciones = estaciones or _Diccionario()
+        self.usuario = array('I')
+        self.nombre = array('I')
+        self.estacion = array('I')
+        self.timestamp = array('d')
+        self.desfase = array('d')  # Desfase UTC del timestamp original (NaN: sin zona)
+        self.status = array('i')
+        self.punch = array('i')
+        self.tipo = array('b')
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def _vacio(self):
+        """Lote vacío que comparte los diccionarios de este"""
+        return LoteRegistros(self.usuarios, self.nombres, self.estaciones)
+
+    # ————— Bordes: conversión desde/hacia diccionarios —————
+    @classmethod
+    def desde_registros(cls, registros, fechas=None):
+        """
+        Crea un lote a partir de registros en el formato de construir_registro.
+        Un registro sin 'nombre' queda como 'N/A', igual que en el formato de
+        envío; un nombre None se conserva. Con `fechas` (FechasRegistros) se
+        reutilizan los timestamps ya parseados en etapas anteriores.
+        """
+        lote = cls()
+        for r in registros:
+            if not r.get('timestamp'):
+                fecha = None
+            else:
+                fecha = fechas.fecha(r) if fechas is not None else parsear_timestamp(r['timestamp'])
+            lote.agregar(
+                r['user_id'], r.get('nombre', 'N/A'), fecha, r.get('status'),
+                r.get('punch', 0), r.get('estacion'), r.get('tipo'),
+            )
+        return lote
+
+    def agregar(self, user_id, nombre, timestamp, status, punch=0, estacion=None, tipo=None):
+        """Agrega un registro al final del lote"""
+        self.usuario.append(self.usuarios.codificar(user_id))
+        self.nombre.append(self.nombres.codificar(nombre))
+        self.estacion.append(self.estaciones.codificar(estacion))
+        if isinstance(timestamp, str):
+            timestamp = parsear_timestamp(timestamp)  # Una sola vez para época y desfase
+        self.timestamp.append(a_epoca(timestamp))
+        self.desfase.append(desfase_de(timestamp))
+        self.status.append(status if status is not None else -1)
+        self.punch.append(punch or 0)
+        self.tipo.append(CODIGOS_TIPO.get(tipo, TIPO_SIN_CLASIFICAR))
+
+    def registro(self, i):
+        """Devuelve el registro i como diccionario"""
+        fecha = self.fecha(i)
+        registro = {
+            'user_id': self.usuarios.valores[self.usuario[i]],
+            'nombre': self.nombres.valores[self.nombre[i]],
+            'timestamp': fecha.isoformat() if fecha else None,
+            'status': self.status[i] if self.status[i] != -1 else None,
+            'estacion': self.estaciones.valores[self.estacion[i]],
+            'punch': self.punch[i],
+        }
+        if self.tipo[i] != TIPO_SIN_CLASIFICAR:
+            registro['tipo'] = NOMBRES_TIPO[self.tipo[i]]
+        return registro
+
+    def fecha(self, i):
+        """datetime del registro i, con su zona horaria original si la tenía"""
+        return desde_epoca(self.timestamp[i], self.desfase[i])
+
+    def a_registros(self):
+        """Convierte el lote completo a una lista de diccionarios"""
+        return [self.registro(i) for i in range(len(self))]
+
+    # ————— Selección —————
+    def seleccionar(self, indices):
+        """Nuevo lote con los registros indicados, en ese orden"""
+        lote = self._vacio()
+        for columna in ('usuario', 'nombre', 'estacion', 'timestamp', 'desfase', 'status', 'punch', 'tipo'):
+            origen = getattr(self, columna)
+            getattr(lote, columna).extend(origen[i] for i in indices)
+        return lote
+
+    def filtrar(self, mascara):
+        """Nuevo lote con los registros cuya posición en `mascara` es verdadera"""
+        return self.seleccionar([i for i, incluir in enumerate(mascara) if incluir])
+
+    def filtrar_periodo(self, desde=None, hasta=None):
+        """Registros con desde <= timestamp < hasta (datetime o texto ISO)"""
+        inicio = a_epoca(desde) if desde is not None else -math.inf
+        fin = a_epoca(hasta) if hasta is not None else math.inf
+        return self.filtrar(inicio <= t < fin for t in self.timestamp)
+
+    def indices_por_usuario(self):
+        """
+        Agrupa las posiciones por usuario (en orden de primera aparición) y
+        ordena cada grupo cronológicamente, conservando el orden original en
+        empates.
+        """
+        grupos = {}
+        for i, codigo in enumerate(self.usuario):
+            grupos.setdefault(codigo, []).append(i)
+        timestamp = self.timestamp
+        for indices in grupos.values():
+            indices.sort(key=timestamp.__getitem__)
+        return grupos
+
+    # ————— Procesamiento —————
+    def clasificar(self):
+        """
+        Asigna Entrada/Salida a cada registro con la misma regla que
+        registros.procesar_registros: el tipo alterna respecto al registro
+        anterior del usuario, procesando en el orden del lote.
+        """
+        marcas_por_usuario = {}
+        timestamp = self.timestamp
+        tipo = self.tipo
+        for i, codigo in enumerate(self.usuario):
+            marcas, tipos = marcas_por_usuario.setdefault(codigo, ([], []))
+            t = timestamp[i]
+            j = bisect_left(marcas, t)
+            nuevo = TIPO_ENTRADA if j == 0 else 1 - tipos[j - 1]
+            if j == len(marcas) or marcas[j] != t:
+                marcas.insert(j, t)
+                tipos.insert(j, nuevo)
+            tipo[i] = nuevo
+        return self
+
+    def emparejar(self):
+        """
+        Empareja Entradas y Salidas de cada usuario en orden cronológico.
+        Devuelve (código de usuario, índice de entrada, índice de salida o None);
+        una entrada sin salida queda al final de su usuario.
+        """
+        pares = []
+        tipo = self.tipo
+        for codigo, indices in self.indices_por_usuario().items():
+            entrada = None
+            for i in indices:
+                if tipo[i] == TIPO_ENTRADA:
+                    entrada = i
+                elif tipo[i] == TIPO_SALIDA and entrada is not None:
+                    pares.append((codigo, entrada, i))
+                    entrada = None
+            if entrada is not None:
+                pares.append((codigo, entrada, None))
+        return pares
+
+    def calcular_horas(self, pares=None):
+        """Total de horas por user_id, igual que calculos.calcular_horas_todos"""
+        pares = self.emparejar() if pares is None else pares
+        totales = {}
+        timestamp = self.timestamp
+        for codigo, entrada, salida in pares:
+            if salida is None:
+                continue
+            user_id = self.usuarios.valores[codigo]
+            totales[user_id] = totales.get(user_id, 0) + (timestamp[salida] - timestamp[entrada]) / 3600
+        return {user_id: round(total, 2) for user_id, total in totales.items()}
+
+    def formatear_para_envio(self, estacion):
+        """Pares Entrada/Salida en el formato de registros.formatear_registros_para_envio"""
+        datos_formateados = []
+        for codigo, entrada, salida in self.emparejar():
+            inicio = self.fecha(entrada)
+            if salida is None:
+                nombre = self.nombres.valores[self.nombre[entrada]]
+                fin = None
+            else:
+                nombre = self.nombres.valores[self.nombre[salida]]
+                fin = self.fecha(salida)
+            datos_formateados.append({
+                'usuario_id': self.usuarios.valores[codigo],
+                'nombre': nombre,
+                'cedula': None,  # La cédula la asigna el backend
+                'estacion': estacion,
+                'entrada': inicio.isoformat(),
+                'salida': fin.isoformat() if fin else None,
+                'horas_trabajadas': round((fin - inicio).total_seconds() / 3600, 2) if fin else None,
+                'en_turno': fin is None
+            })
+        return datos_formateados
@@ -0,0 +1,110 @@
+# planificador.py
+"""
+Intervalo adaptativo entre ciclos
+=================================
+Calcula la espera hasta el siguiente ciclo según la llegada de marcaciones:
+si el último ciclo encontró registros nuevos el intervalo se reduce a la
+mitad, y si no encontró nada se duplica, siempre entre un mínimo y un máximo.
+
+Los perfiles horarios cambian esos límites en franjas del día. Por defecto
+hay uno alrededor del inicio de cada turno de utils.TURNOS (06:00 y 22:00),
+donde el intervalo se mantiene en el mínimo.
+"""
+
+from datetime import datetime, timedelta
+
+from utils import TURNOS
+
+MINUTOS_DIA = 24 * 60
+
+
+def minutos_del_dia(texto):
+    """Convierte 'HH:MM' a minutos desde medianoche"""
+    horas, minutos = texto.split(':')
+    return (int(horas) * 60 + int(minutos)) % MINUTOS_DIA
+
+
+def perfiles_cambio_turno(ventana_minutos, minimo):
+    """Un perfil por cada inicio de turno, con el intervalo fijo en el mínimo"""
+    perfiles = []
+    for turno in TURNOS.values():
+        inicio = turno['inicio'] * 60
+        perfiles.append({
+            'desde': (inicio - ventana_minutos) % MINUTOS_DIA,
+            'hasta': (inicio + ventana_minutos) % MINUTOS_DIA,
+            'max_minutos': minimo,
+        })
+    return perfiles
+
+
+def normalizar_perfiles(perfiles):
+    """Perfiles de configuración ('HH:MM') a minutos del día"""
+    normalizados = []
+    for perfil in perfiles or []:
+        normalizado = dict(perfil)
+        for campo in ('desde', 'hasta'):
+            if isinstance(normalizado[campo], str):
+                normalizado[campo] = minutos_del_dia(normalizado[campo])
+        normalizados.append(normalizado)
+    return normalizados
+
+
+def _en_franja(minuto, desde, hasta):
+    if desde <= hasta:
+        return desde <= minuto < hasta
+    return minuto >= desde or minuto < hasta  # Franja que cruza la medianoche
+
+
+class PlanificadorIntervalo:
+    """Intervalo entre ciclos que se adapta a las marcaciones recientes"""
+
+    def __init__(self, intervalo_inicial, minimo, maximo, perfiles=None):
+        self.minimo = float(minimo)
+        self.maximo = max(float(maximo), self.minimo)
+        self.perfiles = normalizar_perfiles(perfiles)
+        self.intervalo = min(max(float(intervalo_inicial), self.minimo), self.maximo)
+
+    def limites(self, ahora):
+        """Mínimo y máximo vigentes a la hora indicada"""
+        minuto = ahora.hour * 60 + ahora.minute
+        minimo, maximo = self.minimo, self.maximo
+        for perfil in self.perfiles:
+            if _en_franja(minuto, perfil['desde'], perfil['hasta']):
+                minimo = perfil.get('min_minutos', minimo)
+                maximo = perfil.get('max_minutos', maximo)
+        return minimo, max(maximo, minimo)
+
+    def segundos_hasta_perfil(self, ahora, maximo_minutos):
+        """Segundos hasta el próximo perfil cuyo máximo sea menor que el indicado"""
+        minuto = ahora.hour * 60 + ahora.minute + ahora.second / 60
+        espera = None
+        for perfil in self.perfiles:
+            if perfil.get('max_minutos', self.maximo) >= maximo_minutos:
+                continue
+            faltan = (perfil['desde'] - minuto) % MINUTOS_DIA
+            if faltan > 0 and (espera is None or faltan < espera):
+                espera = faltan
+        return espera * 60 if espera is not None else None
+
+    def siguiente(self, registros_nuevos, ahora=None):
+        """
+        Actualiza el intervalo con el resultado del último ciclo y devuelve
+        los segundos a esperar hasta el siguiente.
+        """
+        ahora = ahora or datetime.now()
+        if registros_nuevos:
+            self.intervalo /= 2
+        else:
+            self.intervalo *= 2
+        minimo, maximo = self.limites(ahora)
+        self.intervalo = min(max(self.intervalo, minimo), maximo)
+
+        segundos = self.intervalo * 60
+        # No pasar de largo el inicio de una franja más exigente
+        hasta_perfil = self.segundos_hasta_perfil(ahora, self.intervalo)
+        if hasta_perfil is not None and hasta_perfil < segundos:
+            segundos = hasta_perfil
+        return max(1, int(round(segundos)))
+
+    def proxima_ejecucion(self, segundos, ahora=None):
+        return (ahora or datetime.now()) + timedelta(seconds=segundos)
@@ -0,0 +1,53 @@
+# registro_asistencia.py
+"""
+Registro de asistencia en memoria
+=================================
+Marcación leída del dispositivo, lista para guardarse en la cola de envíos.
+
+Usa __slots__ en lugar de un diccionario por registro y guarda la fecha como
+el datetime que entrega pyzk; el texto ISO solo se genera al serializar. Los
+textos que se repiten en muchos registros (user_id, nombre y estación) se
+internan, de modo que todos los registros comparten la misma cadena.
+"""
+
+import sys
+
+
+def _internar(texto):
+    return sys.intern(texto) if type(texto) is str else texto
+
+
+class RegistroAsistencia:
+    """Marcación de un usuario en una estación"""
+
+    __slots__ = ('user_id', 'nombre', 'fecha', 'status', 'estacion', 'punch')
+
+    def __init__(self, user_id, nombre, fecha, status, estacion, punch=0):
+        self.user_id = _internar(user_id)
+        self.nombre = _internar(nombre)
+        self.fecha = fecha
+        self.status = status
+        self.estacion = _internar(estacion)
+        self.punch = punch
+
+    @property
+    def timestamp(self):
+        """Timestamp en texto ISO, como se envía al servidor"""
+        return self.fecha.isoformat() if self.fecha else None
+
+    def para_envio(self):
+        """
+        Diccionario en el formato de envío al servidor. Reutiliza las cadenas
+        del registro; solo se crea el texto ISO del timestamp.
+        """
+        return {
+            'user_id': self.user_id,
+            'nombre': self.nombre,
+            'timestamp': self.timestamp,
+            'status': self.status,
+            'estacion': self.estacion,
+            'punch': self.punch,
+        }
+
+    def __repr__(self):
+        return f"RegistroAsistencia({self.user_id!r}, {self.nombre!r}, {self.timestamp!r})"
@@ -1,76 +1,54 @@
-from utils import detectar_turno
-from calculos import determinar_tipo_registro
-from datetime import datetime
+from bisect import bisect_left
+from utils import detectar_turno, FechasRegistros
+from lote_registros import LoteRegistros
 
-def procesar_registros(registros):
+def procesar_registros(registros, fechas=None):
+    """
+    Clasifica cada registro como Entrada o Salida y le asigna el turno.
+    El tipo alterna respecto al registro anterior del mismo usuario (el de
+    timestamp inmediatamente menor), igual que determinar_tipo_registro, pero
+    sin recorrer de nuevo todo el historial del usuario en cada registro.
+    Con `fechas` (FechasRegistros) se reutilizan los timestamps ya parseados
+    y los que se parseen aquí quedan para las etapas siguientes.
+    """
     registros_por_usuario = {}
+    # Por usuario: timestamps distintos ya vistos, en orden, y el tipo del
+    # primer registro procesado con cada uno de ellos
+    marcas_por_usuario = {}
+    fechas = FechasRegistros() if fechas is None else fechas
 
     for registro in registros:
         user_id = registro['user_id']
-        registros_usuario = registros_por_usuario.get(user_id, [])
-
-        # Determinar tipo (Entrada/Salida)
-        tipo = determinar_tipo_registro(registro, registros_usuario)
+        registros_usuario = registros_por_usuario.get(user_id)
+        if registros_usuario is None:
+            registros_usuario = registros_por_usuario[user_id] = []
+            marcas_por_usuario[user_id] = ([], [])
+        marcas, tipos = marcas_por_usuario[user_id]
+
+        # Determinar tipo (Entrada/Salida); con registros en orden la búsqueda
+        # cae siempre al final y la inserción es un append
+        timestamp = fechas.epoca(registro)
+        i = bisect_left(marcas, timestamp)
+        if i == 0:
+            tipo = 'Entrada'  # No hay registros previos
+        else:
+            tipo = 'Salida' if tipos[i - 1] == 'Entrada' else 'Entrada'
+        if i == len(marcas) or marcas[i] != timestamp:
+            marcas.insert(i, timestamp)
+            tipos.insert(i, tipo)
         registro['tipo'] = tipo
 
         # Detectar turno
-        hora = datetime.fromisoformat(registro['timestamp']).hour
+        hora = fechas.fecha(registro).hour
         registro['turno'] = detectar_turno(hora)
 
         registros_usuario.append(registro)
-        registros_por_usuario[user_id] = registros_usuario
 
     return [registro for registros_usuario in registros_por_usuario.values() for registro in registros_usuario]
 
-def formatear_registros_para_envio(registros, estacion):
+def formatear_registros_para_envio(registros, estacion, fechas=None):
     """
     Prepara los registros para enviarlos al backend en el formato que el template espera.
+    El emparejamiento Entrada/Salida se hace sobre un lote columnar.
     """
-    datos_formateados = []
-    registros_por_usuario = {}
-
-    # Agrupar registros por usuario
-    for r in registros:
-        registros_por_usuario.setdefault(r['user_id'], []).append(r)
-
-    for user_id, registros_usuario in registros_por_usuario.items():
-        registros_usuario.sort(key=lambda r: r['timestamp'])
-        entrada = None
-
-        for reg in registros_usuario:
-            timestamp = datetime.fromisoformat(reg['timestamp'])
-
-            if reg.get('tipo') == 'Entrada':
-                entrada = timestamp
-                nombre = reg.get('nombre', 'N/A')
-            elif reg.get('tipo') == 'Salida' and entrada:
-                salida = timestamp
-                nombre = reg.get('nombre', 'N/A')
-                duracion = (salida - entrada).total_seconds() / 3600
-
-                datos_formateados.append({
-                    'usuario_id': user_id,
-                    'nombre': nombre,
-                    'cedula': None,  # La cédula la asigna el backend
-                    'estacion': estacion,
-                    'entrada': entrada.isoformat(),
-                    'salida': salida.isoformat(),
-                    'horas_trabajadas': round(duracion, 2),
-                    'en_turno': False
-                })
-                entrada = None
-
-        # Si quedó entrada sin salida
-        if entrada:
-            datos_formateados.append({
-                'usuario_id': user_id,
-                'nombre': nombre,
-                'cedula': None,  # La cédula la asigna el backend
-                'estacion': estacion,
-                'entrada': entrada.isoformat(),
-                'salida': None,
-                'horas_trabajadas': None,
-                'en_turno': True
-            })
-
-    return datos_formateados
\ No newline at end of file
+    return LoteRegistros.desde_registros(registros, fechas).formatear_para_envio(estacion)
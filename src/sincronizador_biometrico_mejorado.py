@@ -2,23 +2,90 @@
 
 import os
 import json
-import requests
+import hashlib
 import logging
 import time
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import threading
+import queue
+import atexit
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
 from zk import ZK
 from datetime import datetime
 import socket
 import subprocess
 from PIL import Image, ImageDraw
 import sys
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from estado_dispositivos import (EstadoDispositivos, clave_dispositivo, identidad_registro,
+                                 es_posterior_a_marca, calcular_marca_agua, AcumuladorMarca)
+from cola_envios import ColaEnvios, inicio_retencion
+from registro_asistencia import RegistroAsistencia
+from cliente_http import post_json, estadisticas_conexiones, sondear, configurar_pool
+from circuito import InterruptorCircuito, ABIERTO, SEMIABIERTO
+from planificador import PlanificadorIntervalo, perfiles_cambio_turno
+from log_estructurado import FiltroContexto, FormatoJSON, iniciar_ciclo, fijar_dispositivo, fijar_etapa
 
 # ————— Configuración de logging mejorada —————
-def setup_logging():
-    """Configura el sistema de logging con rotación de archivos"""
+LOG_COLA_MAXIMO = 10000  # Registros de log en espera de escribirse a disco/consola
+log_listener = None  # Hilo que escribe los logs encolados
+
+class ColaLogHandler(QueueHandler):
+    """
+    QueueHandler con cola acotada: en el hilo que registra, emitir un log es
+    solo ponerlo en la cola. Si la cola está llena se descartan los mensajes
+    informativos; los de WARNING o más esperan un momento a que haya lugar.
+    """
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+        self.maximo_en_cola = 0
+
+    def enqueue(self, record):
+        try:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=1)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+            return
+        en_cola = self.queue.qsize()
+        if en_cola > self.maximo_en_cola:
+            self.maximo_en_cola = en_cola
+
+def estadisticas_logging():
+    """Registros en cola, máximo alcanzado y descartados del logging asíncrono"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, ColaLogHandler):
+            return {
+                'en_cola': handler.queue.qsize(),
+                'maximo_en_cola': handler.maximo_en_cola,
+                'descartados': handler.descartados,
+            }
+    return {'en_cola': 0, 'maximo_en_cola': 0, 'descartados': 0}
+
+def detener_logging():
+    """Escribe los logs pendientes y detiene el hilo de logging"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.close()
+        log_listener = None
+
+def setup_logging(log_json=False):
+    """
+    Configura el sistema de logging con rotación de archivos. Los handlers de
+    archivo y consola corren en un hilo propio (QueueListener); el logger
+    raíz solo encola los registros. Con `log_json` se escribe además el log
+    estructurado (JSON lines) en biometrico_sync.jsonl.
+    """
     from logging.handlers import RotatingFileHandler
+    global log_listener
     
     # Obtener directorio del ejecutable o script
     if getattr(sys, 'frozen', False):
@@ -43,9 +110,11 @@ def setup_logging():
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
     
-    # Limpiar handlers existentes
+    # Limpiar handlers existentes (y escribir lo pendiente de una configuración anterior)
+    detener_logging()
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
+    handlers = []
     
     # Handler para archivo con rotación
     try:
@@ -58,22 +127,46 @@ def setup_logging():
         file_handler.setLevel(logging.INFO)
         file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
         print(f"OK: Logging configurado correctamente: {log_file_path}")
     except Exception as e:
         print(f"ERROR: Error configurando file logging: {e}")
     
+    # Log estructurado con ciclo, dispositivo, etapa y duración
+    if log_json:
+        try:
+            json_handler = RotatingFileHandler(
+                os.path.splitext(log_file_path)[0] + '.jsonl',
+                maxBytes=10*1024*1024,  # 10MB
+                backupCount=5,
+                encoding='utf-8'
+            )
+            json_handler.setLevel(logging.INFO)
+            json_handler.setFormatter(FormatoJSON())
+            handlers.append(json_handler)
+        except Exception as e:
+            print(f"ERROR: Error configurando log JSON: {e}")
+    
     # Handler para consola
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
+    
+    # Escritura en segundo plano
+    cola = queue.Queue(maxsize=LOG_COLA_MAXIMO)
+    cola_handler = ColaLogHandler(cola)
+    cola_handler.addFilter(FiltroContexto())  # El contexto se toma en el hilo que registra
+    logger.addHandler(cola_handler)
+    log_listener = QueueListener(cola, *handlers, respect_handler_level=True)
+    log_listener.start()
     
     return logger
 
 # Inicializar logging
 logger = setup_logging()
+atexit.register(detener_logging)
 logging.info("INICIO: Script de sincronizacion biometrica mejorado iniciado")
 
 # ————— Función para obtener ruta de logs —————
@@ -100,13 +193,118 @@ DEFAULT_CONFIG = {
     'INTERVALO_MINUTOS': 5,
     'AUTO_START': False,
     'MINIMIZE_TO_TRAY': True,
-    'START_WITH_WINDOWS': False
+    'START_WITH_WINDOWS': False,
+    'SYNC_INCREMENTAL': True,  # Enviar solo registros posteriores a la última subida confirmada
+    'TAMANO_LOTE': 500,  # Registros por petición al servidor
+    'HILOS_ENVIO': 1,  # Lotes enviados en paralelo (1 = secuencial; como máximo 32, el tope del pool HTTP)
+    'MAX_INTENTOS_ENVIO': 5,  # Rechazos (4xx) de un registro antes de apartarlo de la cola
+    'COMPRESION': None,  # 'gzip' o 'zstd' para comprimir el cuerpo de los envíos
+    'COMPRESION_MIN_BYTES': 1024,  # Por debajo de este tamaño se envía JSON plano
+    'SESION_PERSISTENTE': False,  # Mantener la conexión con el dispositivo abierta entre ciclos
+    'MODO_TIEMPO_REAL': False,  # Recibir marcaciones en vivo; el ciclo completo queda como reconciliación
+    'DISPOSITIVOS': [],  # Lista de {IP_BIOMETRICO, PUERTO_BIOMETRICO, NOMBRE_ESTACION}; vacía = dispositivo único
+    'MAX_DISPOSITIVOS_PARALELO': 4,  # Dispositivos leídos a la vez
+    'TIMEOUT_DISPOSITIVO_SEGUNDOS': 300,  # Tiempo máximo de lectura por dispositivo
+    'CACHE_USUARIOS_HORAS': 24,  # Vigencia máxima del directorio de usuarios en caché
+    'PURGAR_DISPOSITIVO': False,  # Borrar el log del dispositivo cuando todo está confirmado por el servidor
+    'PURGA_MIN_REGISTROS': 1000,  # Registros en el dispositivo a partir de los cuales se purga
+    'RETENCION_COLA_DIAS': 30,  # Días que se conservan en la cola los confirmados y el índice de duplicados (0 = siempre)
+    'INTERVALO_ADAPTATIVO': False,  # Acortar el intervalo con marcaciones nuevas y alargarlo sin ellas
+    'INTERVALO_MIN_MINUTOS': 1,
+    'INTERVALO_MAX_MINUTOS': 30,
+    'VENTANA_CAMBIO_TURNO_MINUTOS': 30,  # Alrededor de cada inicio de turno se usa el intervalo mínimo
+    'PERFILES_INTERVALO': None,  # [{desde: 'HH:MM', hasta: 'HH:MM', min_minutos, max_minutos}]; None = cambios de turno
+    'CIRCUITO_UMBRAL_FALLOS': 3,  # Fallos seguidos del servidor que abren el circuito de envíos
+    'CIRCUITO_ESPERA_BASE_SEGUNDOS': 30,  # Primera espera con el circuito abierto (se duplica en cada apertura)
+    'CIRCUITO_ESPERA_MAX_SEGUNDOS': 1800,
+    'LOG_PROGRESO_SEGUNDOS': 5,  # Cada cuánto se informa el progreso al procesar registros
+    'LOG_MUESTREO_REGISTROS': 0,  # Registrar el detalle de 1 de cada N registros (0 = solo los primeros)
+    'LOG_JSON': False  # Escribir también el log estructurado (JSON lines) para consultas
 }
 
 # Variables globales
 config_data = DEFAULT_CONFIG.copy()
 config_data['sync_running'] = False
+config_version = 0  # Aumenta con cada cambio aplicado con actualizar_config()
+config_hash_guardado = None  # Hash del contenido de la configuración escrita en disco
 app = None  # Referencia global a la aplicación para acceso desde funciones
+estado_dispositivos = None  # Estado persistente por dispositivo (marca de agua, etc.)
+cola_envios = None  # Cola local (SQLite) de registros pendientes de envío
+envio_lock = threading.Lock()  # Evita que dos hilos vacíen la cola al mismo tiempo
+sesiones_dispositivo = {}  # Sesiones persistentes abiertas, por "ip:puerto"
+sesiones_lock = threading.Lock()
+KEEPALIVE_SEGUNDOS = 60  # Frecuencia del sondeo de sesiones persistentes durante la espera
+TIMEOUT_CAPTURA_SEGUNDOS = 10  # Espera máxima de cada lectura en el modo tiempo real
+executor_dispositivos = None  # Pool de hilos para leer varios dispositivos a la vez
+dispositivos_en_curso = set()  # Dispositivos cuya lectura aún no ha terminado
+dispositivos_lock = threading.Lock()
+GUI_LOG_LINEAS = 200  # Líneas de log que conserva la ventana
+GUI_LOG_INTERVALO_MS = 100  # Frecuencia con que se vuelcan los logs a la ventana
+registros_nuevos_ultimo_ciclo = 0  # Registros agregados a la cola en el último ciclo
+circuito_envios = None  # Interruptor de circuito de los envíos al servidor
+cache_usuarios = None  # Directorio de usuarios por dispositivo, persistido en disco
+usuarios_en_memoria = {}  # Copia en memoria del directorio, por "ip:puerto"
+usuarios_lock = threading.Lock()
+
+# ————— Directorio de datos locales —————
+def get_data_dir():
+    """Obtiene el directorio donde se guarda el estado local de sincronización"""
+    if getattr(sys, 'frozen', False):
+        app_dir = os.path.dirname(sys.executable)
+    else:
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    data_dir = os.path.join(app_dir, "datos")
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        return data_dir
+    except (OSError, PermissionError):
+        # Si no se puede crear junto a la aplicación, usar AppData / ~/.config
+        if os.name == 'nt':
+            data_dir = os.path.expanduser('~\\AppData\\Local\\SyncBio')
+        else:
+            data_dir = os.path.expanduser('~/.config/syncbio')
+        os.makedirs(data_dir, exist_ok=True)
+        logging.warning(f"WARNING: No se pudo crear directorio datos, usando: {data_dir}")
+        return data_dir
+
+def obtener_estado_dispositivos():
+    """Devuelve el estado persistente por dispositivo, cargándolo la primera vez"""
+    global estado_dispositivos
+    if estado_dispositivos is None:
+        ruta = os.path.join(get_data_dir(), 'estado_dispositivos.json')
+        estado_dispositivos = EstadoDispositivos(ruta)
+        logging.info(f"STATE: Estado de dispositivos en: {ruta}")
+    return estado_dispositivos
+
+def obtener_cola_envios():
+    """Devuelve la cola local de envíos, abriéndola la primera vez"""
+    global cola_envios
+    if cola_envios is None:
+        ruta = os.path.join(get_data_dir(), 'cola_envios.db')
+        cola_envios = ColaEnvios(ruta)
+        logging.info(f"OUTBOX: Cola local de envíos en: {ruta}")
+    return cola_envios
+
+def obtener_cache_usuarios():
+    """Devuelve la caché persistente del directorio de usuarios, cargándola la primera vez"""
+    global cache_usuarios
+    if cache_usuarios is None:
+        ruta = os.path.join(get_data_dir(), 'usuarios_dispositivos.json')
+        cache_usuarios = EstadoDispositivos(ruta)
+        logging.info(f"USERS: Caché de usuarios en: {ruta}")
+    return cache_usuarios
+
+def obtener_circuito_envios():
+    """Devuelve el interruptor de circuito de los envíos, creándolo la primera vez"""
+    global circuito_envios
+    if circuito_envios is None:
+        circuito_envios = InterruptorCircuito(
+            config_data.get('CIRCUITO_UMBRAL_FALLOS', 3),
+            config_data.get('CIRCUITO_ESPERA_BASE_SEGUNDOS', 30),
+            config_data.get('CIRCUITO_ESPERA_MAX_SEGUNDOS', 1800),
+        )
+    return circuito_envios
 
 # ————— Funciones de configuración mejoradas —————
 def get_config_path():
@@ -142,8 +340,49 @@ def get_config_path():
     
     return config_paths
 
+def contenido_config(config=None):
+    """JSON de la configuración persistente (sin datos temporales) y su hash"""
+    config = config_data if config is None else config
+    contenido = json.dumps({k: v for k, v in config.items()
+                            if k not in ['sync_running', '_autostart_mode']},
+                           indent=2, ensure_ascii=False)
+    return contenido, hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+def config_pendiente():
+    """Indica si la configuración en memoria difiere de la guardada en disco"""
+    return contenido_config()[1] != config_hash_guardado
+
+def actualizar_config(cambios):
+    """
+    Aplica los valores que realmente cambian y aumenta la versión de la
+    configuración. Devuelve la lista de claves modificadas.
+    """
+    global config_version
+    modificadas = [k for k, v in cambios.items() if config_data.get(k) != v]
+    if modificadas:
+        # Un solo update: los lectores ven la configuración anterior o la nueva
+        config_data.update({k: cambios[k] for k in modificadas})
+        config_version += 1
+        logging.info(f"CONFIG: Configuración versión {config_version}, cambios en: {', '.join(modificadas)}")
+        # Con otro servidor o token los registros descartados pueden ser aceptados
+        if 'SERVER_URL' in modificadas or 'TOKEN_API' in modificadas:
+            try:
+                obtener_cola_envios().reintentar_descartados()
+            except Exception as e:
+                logging.error(f"OUTBOX: No se pudieron reactivar los registros descartados: {e}")
+    return modificadas
+
+def instantanea_config():
+    """
+    Copia de solo lectura de la configuración para la ruta de sincronización.
+    La copia de un dict se hace en una sola operación bajo el GIL, así que no
+    necesita lock y un ciclo no ve cambios de la interfaz a medio aplicar.
+    """
+    return MappingProxyType(dict(config_data))
+
 def load_config():
     """Carga la configuración desde archivo con búsqueda robusta"""
+    global config_hash_guardado, config_version
     try:
         config_paths = get_config_path()
         
@@ -153,6 +392,9 @@ def load_config():
                     with open(config_path, 'r', encoding='utf-8') as f:
                         loaded_config = json.load(f)
                         config_data.update(loaded_config)
+                        config_version += 1
+                        # Claves nuevas de DEFAULT_CONFIG que falten en el archivo se escriben en el próximo guardado
+                        config_hash_guardado = contenido_config(loaded_config)[1]
                         logging.info(f"CONFIG: Configuracion cargada desde: {config_path}")
                         return
                 except Exception as e:
@@ -167,11 +409,17 @@ def load_config():
         logging.error(f"ERROR: Error cargando configuracion: {e}")
 
 def save_config():
-    """Guarda la configuración actual en archivo con gestión robusta"""
+    """
+    Guarda la configuración actual en archivo con gestión robusta. Si el
+    contenido no cambió desde el último guardado no se escribe nada.
+    """
+    global config_hash_guardado
     try:
-        # Crear una copia sin datos temporales
-        config_to_save = {k: v for k, v in config_data.items() 
-                         if k not in ['sync_running', '_autostart_mode']}
+        # Contenido sin datos temporales
+        contenido, hash_contenido = contenido_config()
+        if hash_contenido == config_hash_guardado:
+            logging.debug("CONFIG: Sin cambios, no se reescribe el archivo")
+            return True
         
         config_paths = get_config_path()
         
@@ -185,7 +433,7 @@ def save_config():
                 temp_config_path = config_path + '.tmp'
                 
                 with open(temp_config_path, 'w', encoding='utf-8') as f:
-                    json.dump(config_to_save, f, indent=2, ensure_ascii=False)
+                    f.write(contenido)
                 
                 # Si la escritura fue exitosa, reemplazar el archivo original
                 if os.path.exists(temp_config_path):
@@ -193,6 +441,7 @@ def save_config():
                         os.remove(config_path)
                     os.rename(temp_config_path, config_path)
                 
+                config_hash_guardado = hash_contenido
                 logging.info(f"CONFIG: Configuracion guardada exitosamente en: {config_path}")
                 return True
                 
@@ -216,8 +465,10 @@ def save_config():
         return False
 
 def auto_save_config():
-    """Guarda la configuración automáticamente en segundo plano"""
+    """Guarda la configuración automáticamente en segundo plano, solo si cambió"""
     try:
+        if not config_pendiente():
+            return
         if save_config():
             logging.debug("CONFIG: Auto-guardado exitoso")
         else:
@@ -626,21 +877,78 @@ def test_tcp_port(ip, puerto, timeout=10):
         logging.warning(f"WARNING: Error en prueba TCP: {e}")
         return False, f"Error TCP: {e}"
 
-def conectar_dispositivo(ip, puerto=4370, timeout=30):
-    """Conecta con el dispositivo biométrico usando múltiples configuraciones"""
+# Configuraciones de conexión en el orden en que se prueban por defecto
+CONFIGURACIONES_CONEXION = [
+    {'force_udp': False, 'ommit_ping': False, 'nombre': 'TCP con ping'},
+    {'force_udp': True, 'ommit_ping': False, 'nombre': 'UDP con ping'},
+    {'force_udp': False, 'ommit_ping': True, 'nombre': 'TCP sin ping'},
+    {'force_udp': True, 'ommit_ping': True, 'nombre': 'UDP sin ping'}
+]
+
+def ordenar_configuraciones(clave):
+    """Pone primero la última configuración que funcionó con el dispositivo"""
+    preferida = obtener_estado_dispositivos().obtener(clave, 'estrategia_conexion')
+    configuraciones = list(CONFIGURACIONES_CONEXION)
+    for config in configuraciones:
+        if config['nombre'] == preferida:
+            configuraciones.remove(config)
+            configuraciones.insert(0, config)
+            break
+    return configuraciones
+
+def registrar_resultado_conexion(clave, nombre, exito, latencia_ms=None):
+    """Actualiza las estadísticas de éxito y latencia de una configuración de conexión"""
+    try:
+        estado = obtener_estado_dispositivos()
+        estadisticas = estado.obtener(clave, 'estadisticas_conexion', {})
+        stats = estadisticas.setdefault(nombre, {'exitos': 0, 'fallos': 0, 'latencia_media_ms': None,
+                                                 'ultima_latencia_ms': None})
+        if exito:
+            stats['exitos'] += 1
+            stats['ultima_latencia_ms'] = latencia_ms
+            if stats['latencia_media_ms'] is None:
+                stats['latencia_media_ms'] = latencia_ms
+            else:
+                # Media acumulada sobre todas las conexiones exitosas
+                stats['latencia_media_ms'] = round(
+                    stats['latencia_media_ms'] + (latencia_ms - stats['latencia_media_ms']) / stats['exitos'])
+        else:
+            stats['fallos'] += 1
+        campos = {'estadisticas_conexion': estadisticas}
+        if exito:
+            campos['estrategia_conexion'] = nombre
+        estado.actualizar_campos(clave, campos)
+    except Exception as e:
+        logging.warning(f"WARNING: No se pudieron guardar las estadísticas de conexión: {e}")
+
+def deshabilitar_dispositivo(conn):
+    """Deshabilita el dispositivo; devuelve True solo si el dispositivo lo confirmó"""
+    try:
+        conn.disable_device()
+        logging.info("DEVICE: Dispositivo deshabilitado temporalmente para sincronizacion")
+        return True
+    except Exception as disable_error:
+        logging.warning(f"WARNING: No se pudo deshabilitar el dispositivo: {disable_error}")
+        return False
+
+def conectar_dispositivo(ip, puerto=4370, timeout=30, deshabilitar=True):
+    """
+    Conecta con el dispositivo biométrico usando múltiples configuraciones.
+    Primero se prueba la última configuración que funcionó con este
+    dispositivo; el resto solo se prueba si esa falla. Con deshabilitar=True
+    el dispositivo queda deshabilitado mientras dure la conexión.
+    """
     logging.info(f"DEVICE: Intentando conectar al dispositivo en {ip}:{puerto} (timeout: {timeout}s)")
     
-    # Probar diferentes configuraciones de conexión
-    configuraciones = [
-        {'force_udp': False, 'ommit_ping': False, 'nombre': 'TCP con ping'},
-        {'force_udp': True, 'ommit_ping': False, 'nombre': 'UDP con ping'},
-        {'force_udp': False, 'ommit_ping': True, 'nombre': 'TCP sin ping'},
-        {'force_udp': True, 'ommit_ping': True, 'nombre': 'UDP sin ping'}
-    ]
+    clave = clave_dispositivo(ip, puerto)
+    configuraciones = ordenar_configuraciones(clave)
+    if configuraciones[0] is not CONFIGURACIONES_CONEXION[0]:
+        logging.info(f"CONN: Usando primero la última configuración exitosa: {configuraciones[0]['nombre']}")
     
     for i, config in enumerate(configuraciones, 1):
         try:
-            logging.info(f"CONN: Intento {i}/4 - {config['nombre']}")
+            logging.info(f"CONN: Intento {i}/{len(configuraciones)} - {config['nombre']}")
+            inicio = time.time()
             
             # Crear conexión ZK con la configuración actual
             zk_config = {k: v for k, v in config.items() if k != 'nombre'}
@@ -651,20 +959,19 @@ def conectar_dispositivo(ip, puerto=4370, timeout=30):
             
             # Probar la conexión obteniendo información del dispositivo
             firmware_version = conn.get_firmware_version()
-            logging.info(f"OK: Conexion exitosa! Firmware: {firmware_version}")
+            latencia_ms = int((time.time() - inicio) * 1000)
+            logging.info(f"OK: Conexion exitosa! Firmware: {firmware_version} ({latencia_ms}ms)")
+            registrar_resultado_conexion(clave, config['nombre'], True, latencia_ms)
             
-            # Intentar deshabilitar el dispositivo temporalmente
-            try:
-                conn.disable_device()
-                logging.info("DEVICE: Dispositivo deshabilitado temporalmente para sincronizacion")
-            except Exception as disable_error:
-                logging.warning(f"WARNING: No se pudo deshabilitar el dispositivo: {disable_error}")
-                # Continuar sin deshabilitar
+            # Intentar deshabilitar el dispositivo temporalmente (si falla se continúa sin deshabilitar)
+            if deshabilitar:
+                deshabilitar_dispositivo(conn)
             
             return conn
             
         except Exception as e:
             logging.warning(f"ERROR: Intento {i} ({config['nombre']}) fallido: {e}")
+            registrar_resultado_conexion(clave, config['nombre'], False)
             if i < len(configuraciones):
                 logging.info("WAIT: Probando siguiente configuración...")
                 time.sleep(2)
@@ -673,6 +980,108 @@ def conectar_dispositivo(ip, puerto=4370, timeout=30):
     logging.error(f"ERROR: Todos los intentos de conexión fallaron para {ip}:{puerto}")
     return None
 
+class SesionDispositivo:
+    """
+    Conexión autenticada con un dispositivo que se mantiene abierta entre ciclos.
+    Antes de usarla se comprueba que siga viva y, si no, se reconecta. El
+    dispositivo solo se deshabilita durante la lectura de registros.
+    """
+    
+    def __init__(self, ip, puerto, timeout=30):
+        self.ip = ip
+        self.puerto = puerto
+        self.timeout = timeout
+        self.conn = None
+        self.deshabilitado = False
+        self.reconexiones = 0
+        self.lock = threading.RLock()
+    
+    def conectada(self):
+        return self.conn is not None
+    
+    def _sigue_viva(self):
+        """Sondeo ligero para comprobar que la conexión sigue abierta"""
+        try:
+            self.conn.get_time()
+            return True
+        except Exception as e:
+            logging.warning(f"DEVICE: La sesión persistente con {self.ip}:{self.puerto} no responde: {e}")
+            return False
+    
+    def obtener_conexion(self):
+        """Devuelve la conexión abierta, reconectando si es necesario"""
+        with self.lock:
+            if self.conn is not None and not self._sigue_viva():
+                self.cerrar()
+            if self.conn is None:
+                logging.info(f"DEVICE: Abriendo sesión persistente con {self.ip}:{self.puerto}...")
+                self.conn = conectar_dispositivo(self.ip, self.puerto, self.timeout, deshabilitar=False)
+                if self.conn is not None:
+                    self.reconexiones += 1
+            else:
+                logging.info(f"DEVICE: Reutilizando sesión persistente con {self.ip}:{self.puerto}")
+            return self.conn
+    
+    def mantener_viva(self):
+        """Sondea la conexión durante la espera entre ciclos; si falla se cierra"""
+        with self.lock:
+            if self.conn is not None and not self._sigue_viva():
+                self.cerrar()
+    
+    def deshabilitar(self):
+        """Deshabilita el dispositivo para la ventana de lectura; devuelve si se logró"""
+        with self.lock:
+            try:
+                self.conn.disable_device()
+                self.deshabilitado = True
+                logging.info("DEVICE: Dispositivo deshabilitado durante la lectura")
+            except Exception as e:
+                logging.warning(f"WARNING: No se pudo deshabilitar el dispositivo: {e}")
+            return self.deshabilitado
+    
+    def habilitar(self):
+        """Vuelve a habilitar el dispositivo si se había deshabilitado"""
+        with self.lock:
+            if self.conn is None or not self.deshabilitado:
+                return
+            try:
+                self.conn.enable_device()
+                self.deshabilitado = False
+                logging.info("DEVICE: Dispositivo habilitado nuevamente")
+            except Exception as e:
+                logging.error(f"ERROR: No se pudo habilitar el dispositivo: {e}")
+    
+    def cerrar(self):
+        """Cierra la conexión; el próximo uso abrirá una nueva"""
+        with self.lock:
+            if self.conn is None:
+                return
+            try:
+                self.habilitar()
+                self.conn.disconnect()
+                logging.info(f"DEVICE: Sesión persistente con {self.ip}:{self.puerto} cerrada")
+            except Exception as e:
+                logging.warning(f"WARNING: Error cerrando la sesión persistente: {e}")
+            finally:
+                self.conn = None
+                self.deshabilitado = False
+
+def obtener_sesion_dispositivo(ip, puerto):
+    """Devuelve la sesión persistente de un dispositivo, creándola si no existe"""
+    clave = clave_dispositivo(ip, puerto)
+    with sesiones_lock:
+        if clave not in sesiones_dispositivo:
+            sesiones_dispositivo[clave] = SesionDispositivo(ip, puerto)
+        return sesiones_dispositivo[clave]
+
+def cerrar_sesiones_dispositivo():
+    """Cierra todas las sesiones persistentes abiertas"""
+    with sesiones_lock:
+        sesiones = list(sesiones_dispositivo.values())
+        sesiones_dispositivo.clear()
+    for sesion in sesiones:
+        sesion.cerrar()
+
 def test_device_connection(ip, puerto):
     """Prueba completa de conexión con el dispositivo"""
     logging.info(f"TEST: === INICIANDO PRUEBA COMPLETA DE CONEXIÓN ===")
@@ -758,7 +1167,112 @@ def obtener_usuarios(conn):
         logging.error(f"ERROR: Error al obtener usuarios: {e}")
         return {}
 
-def obtener_registros_crudos(conn, nombre_estacion):
+def huella_usuarios(conn):
+    """
+    Contadores del dispositivo que cambian al agregar, borrar o reenrolar
+    usuarios. read_sizes() es una sola petición pequeña, a diferencia de
+    get_users(), que transfiere toda la tabla de usuarios.
+    """
+    conn.read_sizes()
+    return [
+        getattr(conn, 'users', 0),
+        getattr(conn, 'fingers', 0),
+        getattr(conn, 'cards', 0),
+        getattr(conn, 'faces', 0),
+    ]
+
+def obtener_mapa_usuarios(conn, clave, config=None, huella=None):
+    """
+    Devuelve el mapa user_id -> nombre de un dispositivo usando la caché.
+    Solo se vuelve a leer la tabla de usuarios si cambian los contadores del
+    dispositivo o si la caché supera CACHE_USUARIOS_HORAS. `huella` permite
+    reutilizar los contadores ya leídos en el ciclo (si no, se leen aquí).
+    """
+    with usuarios_lock:
+        entrada = usuarios_en_memoria.get(clave)
+    if entrada is None:
+        entrada = obtener_cache_usuarios().obtener(clave, 'directorio')
+        if entrada:
+            with usuarios_lock:
+                usuarios_en_memoria[clave] = entrada
+
+    if huella is None:
+        try:
+            huella = huella_usuarios(conn)
+        except Exception as e:
+            logging.warning(f"USERS: No se pudieron leer los contadores del dispositivo: {e}")
+
+    config = config_data if config is None else config
+    vigencia = float(config.get('CACHE_USUARIOS_HORAS', 24) or 0) * 3600
+    if entrada and huella is not None and entrada.get('huella') == huella:
+        edad = time.time() - entrada.get('actualizado', 0)
+        if vigencia <= 0 or edad < vigencia:
+            logging.info(f"USERS: Directorio sin cambios, usando caché ({len(entrada['usuarios'])} usuarios)")
+            return entrada['usuarios']
+        logging.info("USERS: Caché de usuarios vencida, se vuelve a leer")
+    elif entrada:
+        logging.info(f"USERS: Cambió el directorio del dispositivo ({entrada.get('huella')} -> {huella})")
+
+    usuarios = obtener_usuarios(conn)
+    if not usuarios:
+        # Una lectura vacía suele ser un fallo; se conserva la caché anterior
+        return entrada['usuarios'] if entrada else {}
+
+    entrada = {
+        'huella': huella,
+        'actualizado': time.time(),
+        'usuarios': {str(k): v for k, v in usuarios.items()},
+    }
+    with usuarios_lock:
+        usuarios_en_memoria[clave] = entrada
+    obtener_cache_usuarios().actualizar(clave, 'directorio', entrada)
+    return entrada['usuarios']
+
+def resolver_nombre_usuario(r, user_map):
+    """
+    Obtiene el nombre del usuario de un registro de asistencia.
+    Devuelve (nombre, usado_por_defecto).
+    """
+    nombre_usuario = user_map.get(r.user_id)
+    if nombre_usuario:
+        return nombre_usuario, False
+    
+    # Si no se encuentra en el mapeo, intentar obtener el nombre del registro mismo
+    if hasattr(r, 'name') and r.name and r.name.strip():
+        nombre_usuario = r.name.strip()
+        logging.debug(f"USER: Nombre obtenido del registro para user_id {r.user_id}: {nombre_usuario}")
+        return nombre_usuario, False
+    
+    # Como último recurso, usar el formato por defecto
+    logging.debug(f"USER: Usando nombre por defecto para user_id {r.user_id}")
+    return f"Usuario_{r.user_id}", True
+
+def construir_registro(r, nombre_usuario, nombre_estacion):
+    """Convierte un registro de asistencia del dispositivo en un RegistroAsistencia"""
+    return RegistroAsistencia(
+        r.user_id,
+        nombre_usuario,
+        r.timestamp,
+        r.status,
+        nombre_estacion,
+        getattr(r, 'punch', 0)  # Tipo de marcaje si está disponible
+    )
+
+def obtener_registros_crudos(conn, nombre_estacion, marca_agua=None, clave=None, deshabilitado=False,
+                             config=None, huella=None):
+    """
+    Lee los registros de asistencia del dispositivo y devuelve un generador
+    que los valida y prepara para el envío a medida que se consumen.
+    La lectura del dispositivo (y del mapa de usuarios) ocurre aquí mismo,
+    mientras está deshabilitado; el procesamiento queda para el consumidor.
+    Si se indica una marca de agua, solo se generan los registros posteriores
+    a la última subida confirmada. Con `clave` el mapa de usuarios sale de la
+    caché del dispositivo. `deshabilitado` indica que el dispositivo confirmó
+    la deshabilitación; sin eso nunca se purga. `config` es la instantánea de
+    configuración del ciclo (por defecto, config_data) y `huella` los
+    contadores de usuarios ya leídos, si los hay.
+    """
+    config = config_data if config is None else config
     logging.info("RECORDS: Obteniendo registros de asistencia...")
     try:
         # Verificar que la conexión siga activa
@@ -770,223 +1284,830 @@ def obtener_registros_crudos(conn, nombre_estacion):
         
         # Obtener registros de asistencia
         logging.info("GET: Llamando a get_attendance()...")
+        inicio = time.perf_counter()
         registros = conn.get_attendance()
-        logging.info("OK: get_attendance() completado")
+        logging.info(f"OK: get_attendance() completado en {time.perf_counter() - inicio:.2f} s")
         
         if not registros:
             logging.warning("WARNING: No hay registros de asistencia en el dispositivo")
-            return []
+            return iter(())
 
         logging.info(f"GET: Se encontraron {len(registros)} registros de asistencia")
         
         # Obtener información de usuarios para mapear nombres
         logging.info("USERS: Obteniendo mapeo de usuarios...")
-        user_map = obtener_usuarios(conn)
-        logging.info(f"USERS: Se mapearon {len(user_map)} usuarios")
-        
-        logging.info("SYNC: Procesando registros...")
-        data = []
-        registros_filtrados = 0  # Contador de registros filtrados
-        registros_con_nombre_defecto = 0  # Contador de registros con nombre por defecto
-        
-        for i, r in enumerate(registros):
-            try:
-                # Verificar progreso cada 10 registros
-                if i > 0 and i % 10 == 0:
-                    logging.info(f"SYNC: Procesados {i}/{len(registros)} registros...")
-                
-                # FILTRO: Validar que el user_id tenga 5 o más dígitos
-                if not validar_user_id(r.user_id):
-                    registros_filtrados += 1
-                    logging.debug(f"FILTER: Registro filtrado - user_id '{r.user_id}' tiene menos de 5 dígitos")
-                    continue
-                
-                # Obtener el nombre del usuario
-                nombre_usuario = user_map.get(r.user_id)
-                
-                # Si no se encuentra en el mapeo, intentar obtener el nombre del registro mismo
-                if not nombre_usuario:
-                    # Verificar si el registro tiene atributo name
-                    if hasattr(r, 'name') and r.name and r.name.strip():
-                        nombre_usuario = r.name.strip()
-                        logging.debug(f"USER: Nombre obtenido del registro para user_id {r.user_id}: {nombre_usuario}")
-                    else:
-                        # Como último recurso, usar el formato por defecto
-                        nombre_usuario = f"Usuario_{r.user_id}"
-                        registros_con_nombre_defecto += 1
-                        logging.debug(f"USER: Usando nombre por defecto para user_id {r.user_id}")
-                
-                registro_data = {
-                    'user_id': r.user_id,
-                    'nombre': nombre_usuario,
-                    'timestamp': r.timestamp.isoformat() if r.timestamp else None,
-                    'status': r.status,
-                    'estacion': nombre_estacion,
-                    'punch': getattr(r, 'punch', 0)  # Tipo de marcaje si está disponible
-                }
-                data.append(registro_data)
-                
-                # Mostrar algunos ejemplos en el log
-                if i < 5:
-                    logging.info(f"TEST: Registro {i+1}: Usuario {registro_data['user_id']} - {registro_data['nombre']} - {registro_data['timestamp']}")
-                    
-            except Exception as reg_error:
-                logging.error(f"ERROR: Error procesando registro {i}: {reg_error}")
-                continue
+        inicio = time.perf_counter()
+        user_map = obtener_mapa_usuarios(conn, clave, config, huella) if clave else obtener_usuarios(conn)
+        logging.info(f"USERS: Se mapearon {len(user_map)} usuarios en {time.perf_counter() - inicio:.2f} s")
         
-        # Log de resultados del filtrado
-        logging.info(f"FILTER: Se filtraron {registros_filtrados} registros con user_id de menos de 5 dígitos")
-        logging.info(f"USER: {registros_con_nombre_defecto} registros usaron nombre por defecto")
-        logging.info(f"OK: Se procesaron {len(data)} registros válidos de {len(registros)} registros totales")
-        return data
+        # Retención: con el dispositivo aún deshabilitado, purgar su log si ya
+        # está todo confirmado (los registros leídos se procesan igual después)
+        if clave and config.get('PURGAR_DISPOSITIVO', False):
+            purgar_dispositivo_si_confirmado(conn, clave, registros, deshabilitado, config)
         
     except Exception as e:
         logging.error(f"ERROR: Error al obtener registros: {e}")
         import traceback
         logging.error(f"DATA: Detalles del error: {traceback.format_exc()}")
-        return []
+        return iter(())
+
+    return procesar_registros_dispositivo(registros, user_map, nombre_estacion, marca_agua, config)
+
+def purgar_dispositivo_si_confirmado(conn, clave, registros, deshabilitado, config=None):
+    """
+    Borra el log de asistencia del dispositivo solo si cada registro válido
+    leído está en el archivo local y la cola no tiene nada pendiente de
+    confirmar para este dispositivo, es decir, si el servidor ya confirmó
+    todo. Exige que el dispositivo esté deshabilitado (`deshabilitado`
+    confirmado por disable_device), para que no entren marcaciones entre la
+    lectura y el borrado. Los registros con user_id no válido nunca se
+    envían, así que no se exigen en el archivo.
+    """
+    if not deshabilitado:
+        logging.warning("PURGE: El dispositivo no confirmó la deshabilitación, no se purga")
+        return False
+
+    config = config_data if config is None else config
+    minimo = config.get('PURGA_MIN_REGISTROS', 1000) or 0
+    if len(registros) < minimo:
+        logging.debug(f"PURGE: {len(registros)} registros en el dispositivo, se purga a partir de {minimo}")
+        return False
+
+    cola = obtener_cola_envios()
+    pendientes = cola.contar_pendientes(clave) + cola.contar_descartados(clave)
+    if pendientes:
+        logging.info(f"PURGE: {pendientes} registros sin confirmar por el servidor, no se purga el dispositivo")
+        return False
+
+    claves = [
+        (r.user_id, r.timestamp.isoformat() if r.timestamp else None, getattr(r, 'punch', 0))
+        for r in registros if validar_user_id(r.user_id)
+    ]
+    # Lo que llega hasta la marca de agua ya pasó por la cola, y lo anterior al plazo
+    # de retención ya no está en el índice: eso se da por archivado
+    archivados_hasta = None
+    dias = config.get('RETENCION_COLA_DIAS', 30) or 0
+    marca = obtener_estado_dispositivos().obtener(clave, 'marca_agua')
+    if dias and marca and marca.get('timestamp'):
+        archivados_hasta = min(inicio_retencion(dias), marca['timestamp'])
+    faltantes = cola.contar_no_archivados(clave, claves, archivados_hasta)
+    if faltantes:
+        logging.info(f"PURGE: {faltantes} registros del dispositivo no están en el archivo local, no se purga")
+        return False
+
+    try:
+        conn.clear_attendance()
+    except Exception as e:
+        logging.error(f"PURGE: Error borrando el log del dispositivo: {e}")
+        return False
+    obtener_estado_dispositivos().actualizar(clave, 'ultima_purga', {
+        'fecha': datetime.now().isoformat(),
+        'registros': len(registros),
+    })
+    logging.info(f"PURGE: Log del dispositivo borrado, {len(claves)} registros verificados contra el archivo local")
+    return True
+
+def procesar_registros_dispositivo(registros, user_map, nombre_estacion, marca_agua=None, config=None):
+    """
+    Generador: valida, filtra por marca de agua y convierte cada registro del
+    dispositivo en un RegistroAsistencia, uno a uno.
+    Las marcaciones anteriores a RETENCION_COLA_DIAS se consideran archivadas:
+    sus claves ya no están en el índice de duplicados de la cola, así que
+    volver a encolarlas las reenviaría.
+    El log es agregado: el progreso se informa cada LOG_PROGRESO_SEGUNDOS y al
+    final un resumen con los motivos de descarte y el tiempo. El detalle por
+    registro solo se registra para 1 de cada LOG_MUESTREO_REGISTROS (0 = nunca).
+    """
+    if marca_agua:
+        logging.info(f"WATERMARK: Enviando solo registros posteriores a {marca_agua.get('timestamp')}")
+    
+    logging.info("SYNC: Procesando registros...")
+    total = len(registros)
+    config = config_data if config is None else config
+    intervalo_progreso = config.get('LOG_PROGRESO_SEGUNDOS', 5)
+    muestreo = config.get('LOG_MUESTREO_REGISTROS', 0) or 0
+    dias_retencion = config.get('RETENCION_COLA_DIAS', 30) or 0
+    limite_retencion = datetime.fromisoformat(inicio_retencion(dias_retencion)) if dias_retencion else None
+    inicio = time.perf_counter()
+    proximo_progreso = inicio + intervalo_progreso
+    validos = 0
+    registros_con_nombre_defecto = 0  # Contador de registros con nombre por defecto
+    descartes = {}  # Motivo -> cantidad de registros descartados
+    
+    for i, r in enumerate(registros):
+        ahora = time.perf_counter()
+        if ahora >= proximo_progreso:
+            logging.info(f"SYNC: Procesados {i}/{total} registros ({i / (ahora - inicio):.0f} registros/s)...")
+            proximo_progreso = ahora + intervalo_progreso
+        
+        try:
+            # FILTRO: Validar que el user_id tenga 5 o más dígitos
+            if not validar_user_id(r.user_id):
+                descartes['user_id de menos de 5 dígitos'] = descartes.get('user_id de menos de 5 dígitos', 0) + 1
+                continue
+            
+            # FILTRO: Omitir marcaciones fuera del plazo de retención de la cola
+            if limite_retencion and isinstance(r.timestamp, datetime) and r.timestamp < limite_retencion:
+                descartes['archivados (fuera de la retención)'] = descartes.get('archivados (fuera de la retención)', 0) + 1
+                continue
+            
+            # FILTRO: Omitir registros ya subidos en ciclos anteriores
+            if marca_agua and not es_posterior_a_marca(
+                    r.timestamp, identidad_registro(r.user_id, getattr(r, 'punch', 0), r.status), marca_agua):
+                descartes['ya enviados anteriormente'] = descartes.get('ya enviados anteriormente', 0) + 1
+                continue
+            
+            # Obtener el nombre del usuario
+            nombre_usuario, nombre_por_defecto = resolver_nombre_usuario(r, user_map)
+            if nombre_por_defecto:
+                registros_con_nombre_defecto += 1
+            
+            registro_data = construir_registro(r, nombre_usuario, nombre_estacion)
+            
+            # Mostrar algunos ejemplos en el log, y una muestra del resto si se pidió
+            if i < 5 or (muestreo and i % muestreo == 0):
+                logging.info(f"TEST: Registro {i+1}: Usuario {registro_data.user_id} - {registro_data.nombre} - {registro_data.timestamp}")
+                
+        except Exception as reg_error:
+            descartes['error de procesamiento'] = descartes.get('error de procesamiento', 0) + 1
+            if descartes['error de procesamiento'] <= 5:
+                logging.error(f"ERROR: Error procesando registro {i}: {reg_error}")
+            continue
+        
+        validos += 1
+        yield registro_data
+    
+    # Resumen de la etapa
+    duracion = time.perf_counter() - inicio
+    detalle_descartes = ', '.join(f"{cantidad} {motivo}" for motivo, cantidad in descartes.items()) or 'ninguno'
+    logging.info(f"OK: Se procesaron {validos} registros válidos de {total} registros totales en {duracion:.2f} s")
+    logging.info(f"FILTER: Descartados: {detalle_descartes}")
+    if registros_con_nombre_defecto:
+        logging.info(f"USER: {registros_con_nombre_defecto} registros usaron nombre por defecto")
+    if descartes.get('error de procesamiento', 0) > 5:
+        logging.error(f"ERROR: {descartes['error de procesamiento']} registros con error de procesamiento (se mostraron los primeros 5)")
+
+# Resultado del envío de un lote
+ENVIO_OK = 'ok'
+ENVIO_FALLIDO = 'fallido'  # Error de red, del servidor o de configuración: se reintenta tal cual
+ENVIO_RECHAZADO = 'rechazado'  # El servidor rechazó el contenido de los datos (400, 422)
+ENVIO_DEMASIADO_GRANDE = 'demasiado_grande'  # 413: el lote se divide
+
+# Respuestas que no dicen nada de los datos: servidor caído o saturado, token
+# vencido o incorrecto, URL equivocada. Cuentan para el circuito y el lote se
+# reintenta igual más adelante.
+CODIGOS_FALLO_TRANSPORTE = {401, 403, 404, 408, 429}
+CODIGOS_RECHAZO = {400, 422}
 
 def enviar_datos(data, server_url, token=None):
+    """Envía un lote al servidor; devuelve True si lo aceptó"""
+    return enviar_lote(data, server_url, token) == ENVIO_OK
+
+def enviar_lote(data, server_url, token=None, config=None):
+    """Envía un lote al servidor y devuelve uno de los resultados ENVIO_*"""
+    config = config_data if config is None else config
     logging.info(f"SEND: Enviando {len(data)} registros a {server_url}...")
     headers = {'Content-Type': 'application/json'}
     if token:
         headers['Authorization'] = f'Token {token}'
     try:
-        resp = requests.post(server_url, json=data, headers=headers, timeout=30)
+        resp = post_json(server_url, data, headers=headers, timeout=30,
+                         compresion=config.get('COMPRESION'),
+                         umbral_compresion=config.get('COMPRESION_MIN_BYTES', 1024))
         logging.info(f"📨 Código de respuesta: {resp.status_code}")
+        # Los errores del servidor y de transporte cuentan para el circuito; un
+        # rechazo de los datos indica que el servidor está activo
+        fallo_transporte = resp.status_code >= 500 or resp.status_code in CODIGOS_FALLO_TRANSPORTE
+        if fallo_transporte:
+            obtener_circuito_envios().registrar_fallo()
+        else:
+            obtener_circuito_envios().registrar_exito()
         if resp.status_code == 200:
             logging.info("OK: Datos enviados correctamente")
-            return True
-        else:
-            logging.warning(f"ERROR: Error en la respuesta del servidor: {resp.text}")
-            return False
+            return ENVIO_OK
+        logging.warning(f"ERROR: Error en la respuesta del servidor: {resp.text}")
+        if resp.status_code == 413:
+            return ENVIO_DEMASIADO_GRANDE
+        if resp.status_code in CODIGOS_RECHAZO:
+            return ENVIO_RECHAZADO
+        if resp.status_code in (401, 403):
+            logging.error("ERROR: El servidor no aceptó el token; revisar TOKEN_API")
+        elif resp.status_code == 404:
+            logging.error(f"ERROR: El servidor no encontró la URL; revisar SERVER_URL ({server_url})")
+        return ENVIO_FALLIDO
     except Exception as e:
         logging.error(f"ERROR: Error al enviar datos: {e}")
-        return False
+        obtener_circuito_envios().registrar_fallo()
+        return ENVIO_FALLIDO
 
-def main_cycle():
-    """Ciclo principal de sincronización"""
-    # Forzar actualización de configuración desde la UI antes de cada ciclo
+def dividir_en_lotes(elementos, tamano_lote):
+    """Divide una lista en lotes de como máximo `tamano_lote` elementos"""
+    return [elementos[i:i + tamano_lote] for i in range(0, len(elementos), tamano_lote)]
+
+def enviar_lote_dividiendo(lote, server_url, token=None, config=None):
+    """
+    Envía un lote de pares (id, registro). Si el servidor lo rechaza o lo
+    encuentra demasiado grande (413), lo divide en mitades y las envía por
+    separado, hasta aislar los registros que rechaza. Devuelve la lista de
+    (ids, resultado) de cada parte enviada.
+    """
+    resultado = enviar_lote([registro for _, registro in lote], server_url, token, config)
+    if resultado in (ENVIO_RECHAZADO, ENVIO_DEMASIADO_GRANDE) and len(lote) > 1:
+        mitad = len(lote) // 2
+        logging.info(f"SEND: Lote {'rechazado' if resultado == ENVIO_RECHAZADO else 'demasiado grande'}, "
+                     f"se divide en dos de {mitad} y {len(lote) - mitad} registros")
+        partes = enviar_lote_dividiendo(lote[:mitad], server_url, token, config)
+        if any(r == ENVIO_FALLIDO for _, r in partes):
+            return partes + [([i for i, _ in lote[mitad:]], ENVIO_FALLIDO)]
+        return partes + enviar_lote_dividiendo(lote[mitad:], server_url, token, config)
+    if resultado == ENVIO_DEMASIADO_GRANDE:
+        resultado = ENVIO_RECHAZADO  # Un solo registro que no entra: es un dato inválido
+    return [([i for i, _ in lote], resultado)]
+
+def enviar_lotes(lotes, server_url, token=None, hilos=1, config=None):
+    """
+    Envía varios lotes de pares (id, registro), cada uno en su propia
+    petición (ver enviar_lote_dividiendo). Con hilos > 1 los lotes se envían
+    en paralelo; en modo secuencial se deja de enviar al primer fallo (un
+    rechazo no detiene el envío: el servidor está activo). Devuelve la lista
+    de (ids, resultado) de las partes intentadas.
+    """
+    if hilos <= 1 or len(lotes) <= 1:
+        resultados = []
+        for lote in lotes:
+            partes = enviar_lote_dividiendo(lote, server_url, token, config)
+            resultados.extend(partes)
+            if any(r == ENVIO_FALLIDO for _, r in partes):
+                break
+        return resultados
+    
+    with ThreadPoolExecutor(max_workers=min(hilos, len(lotes)), thread_name_prefix='envio') as executor:
+        partes = executor.map(lambda lote: enviar_lote_dividiendo(lote, server_url, token, config), lotes)
+        return [parte for partes_lote in partes for parte in partes_lote]
+
+def drenar_cola(server_url, token=None, config=None):
+    """
+    Envía al servidor los registros pendientes de la cola local, por lotes.
+    Cada lote se marca como enviado solo cuando el servidor lo confirma; si un
+    lote falla, solo ese lote (y los no intentados) quedan en la cola para el
+    próximo ciclo. Un lote rechazado (400, 422) o demasiado grande (413) se
+    divide hasta aislar los registros inválidos; un registro rechazado
+    MAX_INTENTOS_ENVIO veces se descarta para que no bloquee al resto de la
+    cola.
+    """
+    config = config_data if config is None else config
+    if not envio_lock.acquire(blocking=False):
+        logging.info("OUTBOX: Ya hay un envío de la cola en curso, se omite")
+        return True
+    
     try:
-        if 'app' in globals() and app and hasattr(app, 'update_config_from_ui'):
-            logging.info("CONFIG: Actualizando configuración desde la interfaz...")
-            if app.update_config_from_ui():
-                logging.info("CONFIG: ✅ Configuración actualizada correctamente desde la UI")
-            else:
-                logging.warning("CONFIG: ⚠️ Error al actualizar configuración desde la UI")
-    except Exception as config_error:
-        logging.warning(f"CONFIG: Error al actualizar configuración: {config_error}")
+        cola = obtener_cola_envios()
+        pendientes = cola.contar_pendientes()
+        if not pendientes:
+            logging.info("OUTBOX: No hay registros pendientes de envío")
+            return True
+        
+        logging.info(f"OUTBOX: {pendientes} registros pendientes de envío")
+        
+        # Con el circuito abierto no se toca la red; los registros esperan en la cola
+        circuito = obtener_circuito_envios()
+        if not circuito.permite_intento():
+            logging.warning(f"CIRCUIT: Servidor no disponible, próximo intento en "
+                            f"{circuito.segundos_restantes():.0f} segundos; los registros quedan en la cola local")
+            return False
+        if circuito.estado == SEMIABIERTO and not sondear(server_url):
+            circuito.registrar_fallo()
+            return False
+        
+        logging.info(f"SEND: 🌐 URL del servidor que se va a usar: {server_url}")
+        logging.info(f"SEND: 🔑 Token API configurado: {'Sí (' + str(len(token)) + ' caracteres)' if token else 'No'}")
+        
+        tamano_lote = max(1, int(config.get('TAMANO_LOTE', 500)))
+        hilos = configurar_pool(max(1, int(config.get('HILOS_ENVIO', 1))))
+        logging.info(f"SEND: Lotes de {tamano_lote} registros, {hilos} envío(s) en paralelo")
+        
+        maximo_intentos = max(1, int(config.get('MAX_INTENTOS_ENVIO', 5)))
+        enviados = 0
+        rechazados_ids = set()  # Rechazados en este vaciado: se reintentan en el próximo ciclo
+        while True:
+            # Tomar de la cola tantos registros como lotes se pueden enviar a la vez
+            pendientes_ventana = [p for p in cola.obtener_pendientes(tamano_lote * hilos)
+                                  if p[0] not in rechazados_ids]
+            if not pendientes_ventana:
+                break
+            
+            lotes = dividir_en_lotes(pendientes_ventana, tamano_lote)
+            resultados = enviar_lotes(lotes, server_url, token, hilos, config)
+            
+            # Cada parte se confirma (o se marca como fallida o rechazada) por separado
+            fallidos = 0
+            rechazados = 0
+            for ids, resultado in resultados:
+                if resultado == ENVIO_OK:
+                    cola.confirmar(ids)
+                    enviados += len(ids)
+                elif resultado == ENVIO_RECHAZADO:
+                    cola.registrar_rechazo(ids, maximo_intentos)
+                    rechazados_ids.update(ids)
+                    rechazados += 1
+                else:
+                    cola.registrar_fallo(ids)
+                    fallidos += 1
+            
+            if rechazados:
+                logging.warning(f"SEND: {rechazados} lote(s) con {len(rechazados_ids)} registro(s) rechazados por el servidor, se reintentarán en el próximo ciclo")
+            if fallidos or circuito.estado == ABIERTO:
+                logging.error(f"ERROR: ❌ {fallidos} lote(s) fallaron, {cola.contar_pendientes()} registros quedan en cola para el próximo ciclo")
+                return False
+        
+        logging.info(f"OK: ✅ {enviados} registros enviados y confirmados por el servidor")
+        return not rechazados_ids
     
-    # Verificar configuración completa
-    if not config_data['IP_BIOMETRICO'] or not config_data['NOMBRE_ESTACION']:
-        logging.error("ERROR: Configuración incompleta (falta IP o nombre de estación)")
+    except Exception as e:
+        logging.error(f"ERROR: Error vaciando la cola de envíos: {e}")
         return False
-
-    # Logs de configuración actual para verificación
-    logging.info(f"INICIO: Iniciando ciclo de sincronización para {config_data['NOMBRE_ESTACION']}")
-    logging.info(f"TARGET: Objetivo: {config_data['IP_BIOMETRICO']}:{config_data['PUERTO_BIOMETRICO']}")
-    logging.info(f"SERVER: URL del servidor: {config_data['SERVER_URL']}")
-    logging.info(f"TOKEN: Token API configurado: {'Sí' if config_data.get('TOKEN_API') else 'No'}")
-    logging.info(f"INTERVAL: Intervalo de sincronización: {config_data.get('INTERVALO_MINUTOS', 5)} minutos")
     
-    # Verificar conectividad básica
-    tcp_success, tcp_msg = test_tcp_port(config_data['IP_BIOMETRICO'], config_data['PUERTO_BIOMETRICO'])
-    if not tcp_success:
-        logging.warning(f"WARNING: Problema de conectividad: {tcp_msg}")
+    finally:
+        envio_lock.release()
+        stats = estadisticas_conexiones()
+        logging.info(f"HTTP: {stats['peticiones']} peticiones, {stats['conexiones_nuevas']} conexiones nuevas, "
+                     f"{stats['reutilizadas']} reutilizadas (keep-alive), "
+                     f"{stats['bytes_enviados']} de {stats['bytes_json']} bytes JSON enviados")
+
+def sincronizar_dispositivo(ip, puerto, nombre_estacion, config=None):
+    """
+    Lee los registros nuevos de un dispositivo y los guarda en la cola local.
+    Devuelve True si la lectura se completó sin errores. `config` es la
+    instantánea de configuración del ciclo (por defecto, config_data).
+    """
+    config = config_data if config is None else config
+    clave = clave_dispositivo(ip, puerto)
+    fijar_dispositivo(clave)
+    fijar_etapa('lectura')
+    inicio_lectura = time.perf_counter()
+    logging.info(f"DEVICE: Sincronizando {nombre_estacion} ({ip}:{puerto})")
+    
+    sesion = None
+    if config.get('SESION_PERSISTENTE', False):
+        sesion = obtener_sesion_dispositivo(ip, puerto)
+    
+    # Verificar conectividad básica (innecesario si ya hay una sesión abierta)
+    if not (sesion and sesion.conectada()):
+        tcp_success, tcp_msg = test_tcp_port(ip, puerto)
+        if not tcp_success:
+            logging.warning(f"WARNING: Problema de conectividad: {tcp_msg}")
 
     logging.info("DEVICE: Estableciendo conexión con el dispositivo...")
-    conn = conectar_dispositivo(config_data['IP_BIOMETRICO'], config_data['PUERTO_BIOMETRICO'])
+    if sesion:
+        conn = sesion.obtener_conexion()
+    else:
+        conn = conectar_dispositivo(ip, puerto, deshabilitar=False)
     if not conn:
-        logging.error("ERROR: No se pudo establecer conexión con el dispositivo")
+        logging.error(f"ERROR: No se pudo establecer conexión con el dispositivo {ip}:{puerto}")
         return False
+    # Sin sesión el dispositivo queda deshabilitado toda la conexión
+    deshabilitado = False if sesion else deshabilitar_dispositivo(conn)
 
+    lectura_ok = True
     try:
-        # Obtener información del dispositivo
+        # Obtener información del dispositivo; los contadores se reutilizan
+        # para validar la caché de usuarios sin volver a pedirlos
+        huella = None
         try:
             logging.info("INFO: Obteniendo información del dispositivo...")
-            users_count = len(conn.get_users() or [])
-            logging.info(f"USERS: Usuarios registrados en el dispositivo: {users_count}")
+            huella = huella_usuarios(conn)
+            logging.info(f"USERS: Usuarios registrados en el dispositivo: {huella[0]}")
         except Exception as info_error:
             logging.warning(f"WARNING: No se pudo obtener información del dispositivo: {info_error}")
 
-        # Obtener registros
+        # Marca de agua de los últimos registros guardados para este dispositivo
+        marca_agua = None
+        if config.get('SYNC_INCREMENTAL', True):
+            marca_agua = obtener_estado_dispositivos().obtener(clave, 'marca_agua')
+        
+        # Obtener registros (con sesión persistente, solo aquí se deshabilita el dispositivo)
         logging.info("RECORDS: Iniciando obtención de registros...")
+        if sesion:
+            deshabilitado = sesion.deshabilitar()
         try:
-            regs = obtener_registros_crudos(conn, config_data['NOMBRE_ESTACION'])
-            logging.info(f"GET: Obtención de registros completada: {len(regs)} registros")
+            regs = obtener_registros_crudos(conn, nombre_estacion, marca_agua, clave, deshabilitado, config, huella)
+            logging.info("GET: Lectura del dispositivo completada")
         except Exception as reg_error:
             logging.error(f"ERROR: Error durante obtención de registros: {reg_error}")
-            regs = []
-        
-        success = True
-        if regs:
-            logging.info(f"SEND: Preparando envío de {len(regs)} registros al servidor...")
-            logging.info(f"SEND: 🌐 URL del servidor que se va a usar: {config_data['SERVER_URL']}")
-            logging.info(f"SEND: 🔑 Token API configurado: {'Sí (' + str(len(config_data['TOKEN_API'])) + ' caracteres)' if config_data.get('TOKEN_API') else 'No'}")
-            try:
-                success = enviar_datos(regs, config_data['SERVER_URL'], config_data['TOKEN_API'])
-                if success:
-                    logging.info("OK: ✅ Envío de datos completado exitosamente")
-                else:
-                    logging.error("ERROR: ❌ Error en el envío de datos")
-            except Exception as send_error:
-                logging.error(f"ERROR: ❌ Error enviando datos: {send_error}")
-                success = False
+            regs = iter(())
+        finally:
+            if sesion:
+                sesion.habilitar()
+        
+        # Los registros pasan uno a uno a la cola local (el envío se hace después
+        # de liberar el dispositivo); la marca de agua se calcula al vuelo. La
+        # cola es persistente, así que la marca puede avanzar ya.
+        acumulador = AcumuladorMarca(marca_agua)
+        encolados = obtener_cola_envios().encolar(clave, acumulador.recorrer(regs))
+        if encolados:
+            logging.info(f"OUTBOX: {encolados} registros agregados a la cola local")
+            nueva_marca = acumulador.resultado()
+            if nueva_marca:
+                obtener_estado_dispositivos().actualizar(clave, 'marca_agua', nueva_marca)
+                logging.info(f"WATERMARK: Marca de agua actualizada a {nueva_marca['timestamp']}")
         else:
-            logging.info("🟡 No hay datos para enviar en este ciclo")
-            
-        return success
+            logging.info("🟡 No hay registros nuevos en este ciclo")
             
     except Exception as cycle_error:
         logging.error(f"ERROR: Error durante el ciclo de sincronización: {cycle_error}")
         import traceback
         logging.error(f"DATA: Detalles del error: {traceback.format_exc()}")
-        return False
+        lectura_ok = False
         
     finally:
+        if sesion:
+            # La conexión queda abierta para el próximo ciclo salvo que haya fallado
+            sesion.habilitar()
+            if not lectura_ok:
+                sesion.cerrar()
+        else:
+            try:
+                logging.info("DEVICE: Cerrando conexión con el dispositivo...")
+                conn.enable_device()
+                conn.disconnect()
+                logging.info("OK: Dispositivo habilitado y desconectado correctamente")
+            except Exception as e:
+                logging.error(f"ERROR: Error al desconectar: {e}")
+    
+    duracion = time.perf_counter() - inicio_lectura
+    logging.info(f"DEVICE: Lectura de {nombre_estacion} terminada en {duracion:.2f} s", extra={'duracion': duracion})
+    fijar_dispositivo(None)
+    return lectura_ok
+
+def obtener_dispositivos(config=None):
+    """
+    Devuelve la lista de dispositivos a sincronizar. Si DISPOSITIVOS está
+    vacía se usa el dispositivo único configurado en la interfaz. `config`
+    permite usar una instantánea en lugar de config_data.
+    """
+    config = config_data if config is None else config
+    dispositivos = []
+    for d in config.get('DISPOSITIVOS') or []:
+        if not d.get('IP_BIOMETRICO') or not d.get('NOMBRE_ESTACION'):
+            logging.warning(f"CONFIG: Dispositivo ignorado por configuración incompleta: {d}")
+            continue
+        dispositivos.append({
+            'IP_BIOMETRICO': d['IP_BIOMETRICO'],
+            'PUERTO_BIOMETRICO': int(d.get('PUERTO_BIOMETRICO') or 4370),
+            'NOMBRE_ESTACION': d['NOMBRE_ESTACION']
+        })
+    
+    if not dispositivos and config.get('IP_BIOMETRICO') and config.get('NOMBRE_ESTACION'):
+        dispositivos.append({
+            'IP_BIOMETRICO': config['IP_BIOMETRICO'],
+            'PUERTO_BIOMETRICO': config['PUERTO_BIOMETRICO'],
+            'NOMBRE_ESTACION': config['NOMBRE_ESTACION']
+        })
+    return dispositivos
+
+def obtener_executor_dispositivos():
+    """Pool de hilos compartido para leer varios dispositivos a la vez"""
+    global executor_dispositivos
+    if executor_dispositivos is None:
+        max_hilos = max(1, int(config_data.get('MAX_DISPOSITIVOS_PARALELO', 4)))
+        executor_dispositivos = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix='dispositivo')
+    return executor_dispositivos
+
+def sincronizar_dispositivos_en_paralelo(dispositivos, config=None):
+    """
+    Lee varios dispositivos en paralelo con un límite de tiempo por dispositivo.
+    Un dispositivo que no responde se abandona (su hilo sigue en segundo plano
+    y se omite en los ciclos siguientes hasta que termine) sin bloquear al resto.
+    """
+    config = config_data if config is None else config
+    timeout = config.get('TIMEOUT_DISPOSITIVO_SEGUNDOS', 300)
+    executor = obtener_executor_dispositivos()
+    inicios = {}
+    
+    def tarea(d, clave):
+        inicios[clave] = time.time()
+        try:
+            return sincronizar_dispositivo(d['IP_BIOMETRICO'], d['PUERTO_BIOMETRICO'], d['NOMBRE_ESTACION'], config)
+        finally:
+            with dispositivos_lock:
+                dispositivos_en_curso.discard(clave)
+    
+    pendientes = {}
+    enviados = {}
+    todos_ok = True
+    for d in dispositivos:
+        clave = clave_dispositivo(d['IP_BIOMETRICO'], d['PUERTO_BIOMETRICO'])
+        with dispositivos_lock:
+            if clave in dispositivos_en_curso:
+                logging.warning(f"DEVICE: {d['NOMBRE_ESTACION']} ({clave}) sigue ocupado desde un ciclo anterior, se omite")
+                todos_ok = False
+                continue
+            dispositivos_en_curso.add(clave)
+        future = executor.submit(tarea, d, clave)
+        pendientes[future] = (d, clave)
+        enviados[future] = time.time()
+    
+    while pendientes:
+        terminados, _ = wait(list(pendientes), timeout=1, return_when=FIRST_COMPLETED)
+        for future in terminados:
+            d, clave = pendientes.pop(future)
+            try:
+                ok = future.result()
+            except Exception as e:
+                logging.error(f"ERROR: Error sincronizando {d['NOMBRE_ESTACION']} ({clave}): {e}")
+                ok = False
+            todos_ok = todos_ok and ok
+        
+        # Abandonar los dispositivos que superaron su tiempo límite
+        ahora = time.time()
+        for future, (d, clave) in list(pendientes.items()):
+            inicio = inicios.get(clave)
+            if inicio and ahora - inicio > timeout:
+                logging.error(f"ERROR: {d['NOMBRE_ESTACION']} ({clave}) superó el límite de {timeout}s, se continúa sin él")
+            elif not inicio and ahora - enviados[future] > timeout and future.cancel():
+                # Nunca llegó a empezar porque todos los hilos están ocupados
+                logging.error(f"ERROR: {d['NOMBRE_ESTACION']} ({clave}) no pudo iniciarse en {timeout}s, se omite")
+                with dispositivos_lock:
+                    dispositivos_en_curso.discard(clave)
+            else:
+                continue
+            del pendientes[future]
+            todos_ok = False
+    
+    return todos_ok
+
+def main_cycle():
+    """Ciclo principal de sincronización"""
+    iniciar_ciclo()
+    fijar_dispositivo(None)
+    fijar_etapa('configuracion')
+    inicio_ciclo = time.perf_counter()
+    # Forzar actualización de configuración desde la UI antes de cada ciclo
+    try:
+        if 'app' in globals() and app and hasattr(app, 'update_config_from_ui'):
+            logging.info("CONFIG: Actualizando configuración desde la interfaz...")
+            if app.update_config_from_ui():
+                logging.info("CONFIG: ✅ Configuración actualizada correctamente desde la UI")
+            else:
+                logging.warning("CONFIG: ⚠️ Error al actualizar configuración desde la UI")
+    except Exception as config_error:
+        logging.warning(f"CONFIG: Error al actualizar configuración: {config_error}")
+    
+    # Todo el ciclo trabaja con la misma configuración aunque la UI cambie a mitad
+    config = instantanea_config()
+    
+    # Verificar configuración completa
+    dispositivos = obtener_dispositivos(config)
+    if not dispositivos:
+        logging.error("ERROR: Configuración incompleta (falta IP o nombre de estación)")
+        return False
+
+    # Logs de configuración actual para verificación
+    logging.info(f"INICIO: Iniciando ciclo de sincronización para {len(dispositivos)} dispositivo(s)")
+    for dispositivo in dispositivos:
+        logging.info(f"TARGET: Objetivo: {dispositivo['NOMBRE_ESTACION']} - "
+                     f"{dispositivo['IP_BIOMETRICO']}:{dispositivo['PUERTO_BIOMETRICO']}")
+    logging.info(f"SERVER: URL del servidor: {config['SERVER_URL']}")
+    logging.info(f"TOKEN: Token API configurado: {'Sí' if config.get('TOKEN_API') else 'No'}")
+    logging.info(f"INTERVAL: Intervalo de sincronización: {config.get('INTERVALO_MINUTOS', 5)} minutos")
+    logging.info(f"CONFIG: Versión de la configuración: {config_version}")
+    
+    dedup_inicio = obtener_cola_envios().estadisticas_duplicados()
+    if len(dispositivos) == 1:
+        d = dispositivos[0]
+        lectura_ok = sincronizar_dispositivo(d['IP_BIOMETRICO'], d['PUERTO_BIOMETRICO'], d['NOMBRE_ESTACION'], config)
+    else:
+        lectura_ok = sincronizar_dispositivos_en_paralelo(dispositivos, config)
+    
+    # Envío al servidor, ya con los dispositivos habilitados
+    fijar_dispositivo(None)
+    fijar_etapa('envio')
+    inicio_envio = time.perf_counter()
+    envio_ok = drenar_cola(config['SERVER_URL'], config['TOKEN_API'], config)
+    duracion = time.perf_counter() - inicio_envio
+    logging.info(f"SEND: Envío de la cola terminado en {duracion:.2f} s", extra={'duracion': duracion})
+    fijar_etapa('estadisticas')
+    
+    obtener_cola_envios().aplicar_retencion(config.get('RETENCION_COLA_DIAS', 30))
+    dedup = obtener_cola_envios().estadisticas_duplicados()
+    consultados = dedup['consultados'] - dedup_inicio['consultados']
+    duplicados = dedup['duplicados'] - dedup_inicio['duplicados']
+    logging.info(f"STATS: Duplicados descartados: {duplicados} de {consultados} "
+                 f"({duplicados * 100 / consultados if consultados else 0:.1f}%), "
+                 f"índice con {dedup['tamano_indice']} registros")
+    global registros_nuevos_ultimo_ciclo
+    registros_nuevos_ultimo_ciclo = consultados - duplicados
+    log_stats = estadisticas_logging()
+    logging.info(f"STATS: Cola de logs: {log_stats['en_cola']} en espera, máximo {log_stats['maximo_en_cola']}, "
+                 f"{log_stats['descartados']} descartados")
+    duracion = time.perf_counter() - inicio_ciclo
+    logging.info(f"🏁 Ciclo de sincronización completado en {duracion:.2f} s",
+                 extra={'etapa': 'ciclo', 'duracion': duracion})
+    fijar_etapa(None)
+    return lectura_ok and envio_ok
+
+def crear_planificador():
+    """Planificador de intervalo adaptativo según la configuración actual"""
+    minimo = config_data.get('INTERVALO_MIN_MINUTOS', 1)
+    perfiles = config_data.get('PERFILES_INTERVALO')
+    if perfiles is None:
+        perfiles = perfiles_cambio_turno(config_data.get('VENTANA_CAMBIO_TURNO_MINUTOS', 30), minimo)
+    return PlanificadorIntervalo(
+        config_data.get('INTERVALO_MINUTOS', 5),
+        minimo,
+        config_data.get('INTERVALO_MAX_MINUTOS', 30),
+        perfiles,
+    )
+
+def segundos_hasta_siguiente_ciclo(planificador):
+    """Espera hasta el siguiente ciclo: fija o adaptativa según la configuración"""
+    if planificador is None:
+        intervalo = config_data.get('INTERVALO_MINUTOS', 5)
+        logging.info(f"⏱️ Esperando {intervalo} minutos para la siguiente ejecución...")
+        return int(intervalo * 60)
+    
+    segundos = planificador.siguiente(registros_nuevos_ultimo_ciclo)
+    logging.info(f"⏱️ Intervalo adaptativo: {registros_nuevos_ultimo_ciclo} registros nuevos en el último ciclo, "
+                 f"siguiente ejecución en {segundos / 60:.1f} minutos "
+                 f"({planificador.proxima_ejecucion(segundos).strftime('%H:%M:%S')})")
+    return segundos
+
+def esperar_intervalo(stop_event, segundos):
+    """
+    Espera interrumpible entre ciclos. Con sesión persistente, sondea las
+    conexiones abiertas cada KEEPALIVE_SEGUNDOS para mantenerlas vivas.
+    Devuelve True si se activó el stop_event.
+    """
+    if not config_data.get('SESION_PERSISTENTE', False):
+        return stop_event.wait(timeout=segundos)
+    
+    fin = time.time() + segundos
+    while True:
+        restante = fin - time.time()
+        if restante <= 0:
+            return False
+        if stop_event.wait(timeout=min(restante, KEEPALIVE_SEGUNDOS)):
+            return True
+        with sesiones_lock:
+            sesiones = list(sesiones_dispositivo.values())
+        for sesion in sesiones:
+            sesion.mantener_viva()
+
+def ejecutar_ciclo_medido(descripcion):
+    """Ejecuta main_cycle registrando su duración"""
+    logging.info(f"INICIO: === INICIANDO {descripcion} ===")
+    start_time = time.time()
+    try:
+        success = main_cycle()
+        duration = time.time() - start_time
+        if success:
+            logging.info(f"⏱️ {descripcion.capitalize()} completado exitosamente en {duration:.2f} segundos")
+        else:
+            logging.warning(f"⏱️ {descripcion.capitalize()} completado con errores en {duration:.2f} segundos")
+        return success
+    except Exception as cycle_error:
+        logging.exception(f"ERROR: Error en {descripcion.lower()}: {cycle_error}")
+        return False
+
+def procesar_marcacion_en_vivo(r, user_map, clave, nombre_estacion):
+    """
+    Guarda en la cola una marcación recibida en vivo. No avanza la marca de
+    agua: la reconciliación debe volver a leer todo lo posterior a la última
+    lectura completa para recuperar las marcaciones que la captura en vivo
+    no vio; las que sí vio las descarta el índice de duplicados de la cola.
+    """
+    if not validar_user_id(r.user_id):
+        logging.debug(f"FILTER: Marcación en vivo filtrada - user_id '{r.user_id}' tiene menos de 5 dígitos")
+        return False
+    
+    estado = obtener_estado_dispositivos()
+    marca_agua = estado.obtener(clave, 'marca_agua')
+    if not es_posterior_a_marca(r.timestamp, identidad_registro(r.user_id, getattr(r, 'punch', 0), r.status),
+                                marca_agua):
+        return False
+    
+    nombre_usuario, _ = resolver_nombre_usuario(r, user_map)
+    registro = construir_registro(r, nombre_usuario, nombre_estacion)
+    obtener_cola_envios().encolar(clave, [registro])
+    logging.info(f"LIVE: Marcación de {registro.user_id} - {registro.nombre} - {registro.timestamp}")
+    return True
+
+def enviar_cola_al_avisar(aviso, fin, config):
+    """
+    Hilo de envío del modo tiempo real: vacía la cola cada vez que la captura
+    en vivo activa `aviso`, para que la captura solo encole y vuelva a
+    escuchar. Las marcaciones que llegan durante un envío vuelven a activar
+    el aviso y salen en el siguiente. Termina cuando se activa `fin`.
+    """
+    fijar_etapa('envio')
+    while True:
+        aviso.wait()
+        aviso.clear()
+        if fin.is_set():
+            return
         try:
-            logging.info("DEVICE: Cerrando conexión con el dispositivo...")
-            conn.enable_device()
-            conn.disconnect()
-            logging.info("OK: Dispositivo habilitado y desconectado correctamente")
+            drenar_cola(config['SERVER_URL'], config['TOKEN_API'], config)
         except Exception as e:
-            logging.error(f"ERROR: Error al desconectar: {e}")
+            logging.error(f"ERROR: Error enviando marcaciones en vivo: {e}")
+
+def sincronizacion_tiempo_real(stop_event):
+    """
+    Modo tiempo real: escucha las marcaciones del dispositivo con live_capture()
+    y las guarda en la cola local en cuanto llegan; un hilo aparte
+    (enviar_cola_al_avisar) las envía. Cada INTERVALO_MINUTOS se cierra la
+    captura y se ejecuta un ciclo completo como reconciliación, por si se
+    perdió algún evento.
+    """
+    logging.info("LIVE: Modo tiempo real activado")
+    proxima_reconciliacion = 0  # La primera reconciliación se hace de inmediato
+    
+    while config_data['sync_running'] and not stop_event.is_set():
+        if time.time() >= proxima_reconciliacion:
+            ejecutar_ciclo_medido("CICLO DE RECONCILIACIÓN")
+            proxima_reconciliacion = time.time() + config_data.get('INTERVALO_MINUTOS', 5) * 60
+            if stop_event.is_set() or not config_data['sync_running']:
+                break
+        
+        # Cada captura trabaja con una instantánea de la configuración; los cambios
+        # de la UI se toman en la siguiente reconciliación
+        config = instantanea_config()
+        
+        # La captura en vivo escucha un solo dispositivo (el primero configurado);
+        # la reconciliación periódica cubre a todos
+        dispositivos = obtener_dispositivos(config)
+        if not dispositivos:
+            logging.error("ERROR: Configuración incompleta (falta IP o nombre de estación)")
+            stop_event.wait(timeout=30)
+            continue
+        dispositivo = dispositivos[0]
+        ip = dispositivo['IP_BIOMETRICO']
+        puerto = dispositivo['PUERTO_BIOMETRICO']
+        conn = conectar_dispositivo(ip, puerto, deshabilitar=False)
+        if not conn:
+            logging.warning("LIVE: No se pudo abrir la captura en vivo, reintentando en 30 segundos")
+            stop_event.wait(timeout=30)
+            continue
         
-        logging.info("🏁 Ciclo de sincronización completado")
+        clave = clave_dispositivo(ip, puerto)
+        fijar_dispositivo(clave)
+        fijar_etapa('tiempo_real')
+        recibidas = 0
+        aviso_envio = threading.Event()
+        fin_envio = threading.Event()
+        hilo_envio = threading.Thread(target=enviar_cola_al_avisar, args=(aviso_envio, fin_envio, config),
+                                      name='envio-tiempo-real', daemon=True)
+        hilo_envio.start()
+        try:
+            user_map = obtener_mapa_usuarios(conn, clave, config)
+            logging.info("LIVE: Escuchando marcaciones en vivo...")
+            for r in conn.live_capture(new_timeout=TIMEOUT_CAPTURA_SEGUNDOS):
+                # Salir limpiamente (dejando que pyzk restaure el socket) al detener o al reconciliar
+                if stop_event.is_set() or not config_data['sync_running'] or time.time() >= proxima_reconciliacion:
+                    conn.end_live_capture = True
+                    continue
+                if r is None:
+                    continue  # Timeout sin marcaciones
+                
+                if procesar_marcacion_en_vivo(r, user_map, clave, dispositivo['NOMBRE_ESTACION']):
+                    recibidas += 1
+                    aviso_envio.set()
+        except Exception as e:
+            logging.error(f"ERROR: Error en la captura en vivo: {e}")
+            stop_event.wait(timeout=10)
+        finally:
+            logging.info(f"LIVE: Captura en vivo finalizada, {recibidas} marcaciones recibidas")
+            # Lo que quede sin enviar sale en la reconciliación
+            fin_envio.set()
+            aviso_envio.set()
+            hilo_envio.join(timeout=5)
+            try:
+                conn.disconnect()
+            except Exception as e:
+                logging.warning(f"WARNING: Error al desconectar la captura en vivo: {e}")
 
 def sync_worker(stop_event=None):
     """Worker que ejecuta la sincronización automática"""
     try:
         logging.info("SYNC: Worker de sincronización iniciado")
         
+        # Modo tiempo real: captura en vivo con reconciliación periódica
+        if config_data.get('MODO_TIEMPO_REAL', False) and stop_event:
+            sincronizacion_tiempo_real(stop_event)
+            return
+        
         # Ejecutar primer ciclo inmediatamente
         if config_data['sync_running']:
-            try:
-                logging.info("INICIO: === INICIANDO PRIMER CICLO DE SINCRONIZACIÓN ===")
-                start_time = time.time()
-                
-                success = main_cycle()
-                
-                end_time = time.time()
-                duration = end_time - start_time
-                if success:
-                    logging.info(f"⏱️ Primer ciclo completado exitosamente en {duration:.2f} segundos")
-                else:
-                    logging.warning(f"⏱️ Primer ciclo completado con errores en {duration:.2f} segundos")
-            except Exception as e:
-                logging.exception(f"ERROR: Error en primer ciclo: {e}")
+            ejecutar_ciclo_medido("PRIMER CICLO DE SINCRONIZACIÓN")
         
         # Continuar con ciclos periódicos
+        planificador = crear_planificador() if config_data.get('INTERVALO_ADAPTATIVO', False) else None
         while config_data['sync_running']:
             try:
-                intervalo = config_data.get('INTERVALO_MINUTOS', 5)
-                logging.info(f"⏱️ Esperando {intervalo} minutos para la siguiente ejecución...")
-                
                 # Usar threading.Event para espera interrumpible
-                total_seconds = intervalo * 60
+                total_seconds = segundos_hasta_siguiente_ciclo(planificador)
                 if stop_event:
                     # Esperar usando el event, que puede ser interrumpido
-                    if stop_event.wait(timeout=total_seconds):
+                    if esperar_intervalo(stop_event, total_seconds):
                         # El event fue activado, significa que debemos parar
                         logging.info("🛑 Sincronización detenida durante la espera")
                         return  # Salir del worker completamente
@@ -1005,22 +2126,9 @@ def sync_worker(stop_event=None):
                         time.sleep(1)
                 
                 # Si aún está corriendo, ejecutar siguiente ciclo
+                # (un error en el ciclo se registra y se sigue con el siguiente)
                 if config_data['sync_running']:
-                    logging.info("INICIO: === INICIANDO NUEVO CICLO DE SINCRONIZACIÓN ===")
-                    start_time = time.time()
-                    
-                    try:
-                        success = main_cycle()
-                        
-                        end_time = time.time()
-                        duration = end_time - start_time
-                        if success:
-                            logging.info(f"⏱️ Ciclo completado exitosamente en {duration:.2f} segundos")
-                        else:
-                            logging.warning(f"⏱️ Ciclo completado con errores en {duration:.2f} segundos")
-                    except Exception as cycle_error:
-                        logging.exception(f"ERROR: Error en ciclo de sincronización: {cycle_error}")
-                        # Continuar con el siguiente ciclo después del error
+                    ejecutar_ciclo_medido("NUEVO CICLO DE SINCRONIZACIÓN")
                     
             except Exception as e:
                 logging.exception(f"ERROR: Error inesperado en el bucle principal: {e}")
@@ -1042,6 +2150,8 @@ def sync_worker(stop_event=None):
         logging.exception(f"ERROR: Error fatal en worker de sincronización: {fatal_error}")
     finally:
         logging.info("🏁 Worker de sincronización finalizado")
+        # Liberar las sesiones persistentes con los dispositivos
+        cerrar_sesiones_dispositivo()
         # Asegurar que la interfaz se actualice correctamente al salir
         config_data['sync_running'] = False
 
@@ -1311,6 +2421,9 @@ class SyncBioApp:
             save_config()
             logging.info("SYSTEM: Configuración guardada antes de salir")
             
+            # Cerrar sesiones persistentes con los dispositivos
+            cerrar_sesiones_dispositivo()
+            
             # Cerrar icono de bandeja
             if self.tray_icon:
                 logging.info("TRAY: Cerrando icono de bandeja...")
@@ -1643,23 +2756,52 @@ class SyncBioApp:
     def setup_logging_handler(self):
         """Configura un handler personalizado para mostrar logs en la interfaz"""
         class GUILogHandler(logging.Handler):
+            """
+            Acumula los mensajes desde cualquier hilo y los vuelca a la
+            interfaz en bloque cada GUI_LOG_INTERVALO_MS, con una sola
+            inserción. Entre volcados solo se conservan las últimas
+            GUI_LOG_LINEAS líneas, así que el costo en la interfaz no depende
+            de la cantidad de logs.
+            """
             def __init__(self, text_widget, root):
                 super().__init__()
                 self.text_widget = text_widget
                 self.root = root
+                self.pendientes = deque(maxlen=GUI_LOG_LINEAS)
+                self.recibidos = 0  # Mensajes recibidos desde el último volcado
+                self.pendientes_lock = threading.Lock()
+                self.root.after(GUI_LOG_INTERVALO_MS, self.volcar)
             
             def emit(self, record):
-                msg = self.format(record)
-                # Programar la actualización de la interfaz en el hilo principal
-                self.root.after(0, lambda: self.append_log(msg))
-            
-            def append_log(self, msg):
-                self.text_widget.insert(tk.END, msg + '\n')
-                self.text_widget.see(tk.END)
-                # Limitar el número de líneas para evitar consumo excesivo de memoria
-                lines = int(self.text_widget.index('end').split('.')[0])
-                if lines > 200:
-                    self.text_widget.delete('1.0', '50.0')
+                try:
+                    msg = self.format(record)
+                except Exception:
+                    self.handleError(record)
+                    return
+                with self.pendientes_lock:
+                    self.pendientes.append(msg)
+                    self.recibidos += 1
+            
+            def volcar(self):
+                """Se ejecuta en el hilo de la interfaz: inserta lo acumulado de una vez"""
+                with self.pendientes_lock:
+                    lineas = list(self.pendientes)
+                    omitidas = self.recibidos - len(lineas)
+                    self.pendientes.clear()
+                    self.recibidos = 0
+                try:
+                    if lineas:
+                        if omitidas:
+                            lineas.insert(0, f"... {omitidas} líneas omitidas ...")
+                        self.text_widget.insert(tk.END, '\n'.join(lineas) + '\n')
+                        # Limitar el número de líneas para evitar consumo excesivo de memoria
+                        total = int(self.text_widget.index('end-1c').split('.')[0])
+                        if total > GUI_LOG_LINEAS:
+                            self.text_widget.delete('1.0', f'{total - GUI_LOG_LINEAS}.0')
+                        self.text_widget.see(tk.END)
+                    self.root.after(GUI_LOG_INTERVALO_MS, self.volcar)
+                except tk.TclError:
+                    pass  # La ventana ya se cerró
         
         # Agregar el handler a logging
         gui_handler = GUILogHandler(self.log_text, self.root)
@@ -1669,17 +2811,20 @@ class SyncBioApp:
     def update_config_from_ui(self):
         """Actualiza la configuración global desde la interfaz"""
         try:
-            config_data['IP_BIOMETRICO'] = self.ip_var.get().strip()
-            config_data['PUERTO_BIOMETRICO'] = int(self.puerto_var.get().strip() or "4370")
-            config_data['NOMBRE_ESTACION'] = self.estacion_var.get().strip()
-            config_data['INTERVALO_MINUTOS'] = int(self.intervalo_var.get().strip() or "5")
-            config_data['SERVER_URL'] = self.server_var.get().strip()
-            config_data['AUTO_START'] = self.auto_start_var.get()
-            config_data['MINIMIZE_TO_TRAY'] = self.minimize_tray_var.get()
-            config_data['START_WITH_WINDOWS'] = self.start_with_windows_var.get()
-            
-            # Auto-guardar inmediatamente después de actualizar
-            auto_save_config()
+            cambios = actualizar_config({
+                'IP_BIOMETRICO': self.ip_var.get().strip(),
+                'PUERTO_BIOMETRICO': int(self.puerto_var.get().strip() or "4370"),
+                'NOMBRE_ESTACION': self.estacion_var.get().strip(),
+                'INTERVALO_MINUTOS': int(self.intervalo_var.get().strip() or "5"),
+                'SERVER_URL': self.server_var.get().strip(),
+                'AUTO_START': self.auto_start_var.get(),
+                'MINIMIZE_TO_TRAY': self.minimize_tray_var.get(),
+                'START_WITH_WINDOWS': self.start_with_windows_var.get(),
+            })
+            
+            # Auto-guardar inmediatamente si algo cambió
+            if cambios:
+                auto_save_config()
             
             return True
         except ValueError as e:
@@ -2167,15 +3312,52 @@ class SyncBioApp:
             diag_info.append(f"Puerto: {config_data.get('PUERTO_BIOMETRICO', 'No configurado')}")
             diag_info.append(f"Estación: {config_data.get('NOMBRE_ESTACION', 'No configurada')}")
             diag_info.append(f"Intervalo: {config_data.get('INTERVALO_MINUTOS', 'No configurado')} min")
+            if config_data.get('DISPOSITIVOS'):
+                diag_info.append(f"Dispositivos configurados: {len(obtener_dispositivos())}")
+                for d in obtener_dispositivos():
+                    diag_info.append(f"  - {d['NOMBRE_ESTACION']}: {d['IP_BIOMETRICO']}:{d['PUERTO_BIOMETRICO']}")
+            
+            # Estrategias de conexión con el dispositivo
+            clave = clave_dispositivo(config_data.get('IP_BIOMETRICO'), config_data.get('PUERTO_BIOMETRICO'))
+            estado = obtener_estado_dispositivos()
+            diag_info.append(f"\n=== CONEXIÓN CON EL DISPOSITIVO ===")
+            diag_info.append(f"Última estrategia exitosa: {estado.obtener(clave, 'estrategia_conexion') or 'Ninguna'}")
+            for nombre, stats in estado.obtener(clave, 'estadisticas_conexion', {}).items():
+                diag_info.append(f"{nombre}: {stats['exitos']} éxitos, {stats['fallos']} fallos, "
+                                 f"latencia media {stats['latencia_media_ms'] if stats['latencia_media_ms'] is not None else 'N/A'} ms")
+            if config_data.get('PURGAR_DISPOSITIVO', False):
+                purga = estado.obtener(clave, 'ultima_purga')
+                diag_info.append(f"Última purga del log: "
+                                 f"{purga['fecha'] + ' (' + str(purga['registros']) + ' registros)' if purga else 'Nunca'}")
             
             # Información del sistema
             diag_info.append(f"\n=== SISTEMA ===")
             diag_info.append(f"Threads activos: {threading.active_count()}")
             
+            # Conexiones HTTP con el servidor
+            http_stats = estadisticas_conexiones()
+            diag_info.append(f"\n=== CONEXIONES HTTP ===")
+            diag_info.append(f"Peticiones enviadas: {http_stats['peticiones']}")
+            diag_info.append(f"Conexiones nuevas: {http_stats['conexiones_nuevas']}")
+            diag_info.append(f"Peticiones con conexión reutilizada: {http_stats['reutilizadas']}")
+            diag_info.append(f"Errores de conexión: {http_stats['errores']}")
+            diag_info.append(f"Compresión: {config_data.get('COMPRESION') or 'Desactivada'} "
+                             f"({http_stats['bytes_enviados']} de {http_stats['bytes_json']} bytes enviados)")
+            circuito = obtener_circuito_envios().resumen()
+            cola = obtener_cola_envios()
+            diag_info.append(f"Cola de envíos: {cola.contar_pendientes()} pendientes, "
+                             f"{cola.contar_descartados()} descartados por rechazos del servidor")
+            diag_info.append(f"Circuito de envíos: {circuito['estado']} "
+                             f"({circuito['fallos_consecutivos']} fallos seguidos"
+                             f"{', reintento en ' + str(int(circuito['segundos_restantes'])) + ' s' if circuito['estado'] == ABIERTO else ''})")
+            
             # Información de logging
             diag_info.append(f"\n=== LOGGING ===")
             log_file_path = get_log_file_path()
             diag_info.append(f"Archivo de log: {log_file_path}")
+            log_stats = estadisticas_logging()
+            diag_info.append(f"Cola de logs: {log_stats['en_cola']} en espera, máximo {log_stats['maximo_en_cola']}, "
+                             f"{log_stats['descartados']} descartados")
             diag_info.append(f"Log existe: {'Sí' if os.path.exists(log_file_path) else 'No'}")
             if os.path.exists(log_file_path):
                 try:
@@ -2243,6 +3425,8 @@ class SyncBioApp:
                       command=lambda: self.update_diagnostics(diag_text_widget)).pack(side=tk.LEFT, padx=(0, 10))
             ttk.Button(button_frame, text="Copiar al Portapapeles", 
                       command=lambda: self.copy_to_clipboard(diag_text)).pack(side=tk.LEFT, padx=(0, 10))
+            ttk.Button(button_frame, text="Reintentar descartados", 
+                      command=self.retry_discarded).pack(side=tk.LEFT, padx=(0, 10))
             ttk.Button(button_frame, text="Cerrar", 
                       command=diag_window.destroy).pack(side=tk.RIGHT)
             
@@ -2260,6 +3444,16 @@ class SyncBioApp:
         except Exception as e:
             logging.error(f"Error actualizando diagnóstico: {e}")
     
+    def retry_discarded(self):
+        """Vuelve a poner en la cola de envío los registros descartados"""
+        try:
+            reactivados = obtener_cola_envios().reintentar_descartados()
+            logging.info(f"OUTBOX: {reactivados} registro(s) descartados vuelven a la cola de envío")
+            messagebox.showinfo("Cola de envío", f"{reactivados} registro(s) descartados se reintentarán en el próximo ciclo")
+        except Exception as e:
+            logging.error(f"Error reintentando registros descartados: {e}")
+            messagebox.showerror("Error", f"No se pudieron reintentar los registros descartados:\n{e}")
+    
     def copy_to_clipboard(self, text):
         """Copia texto al portapapeles"""
         try:
@@ -2503,6 +3697,8 @@ if __name__ == '__main__':
         
         # Cargar configuración al inicio
         load_config()
+        if config_data.get('LOG_JSON', False):
+            setup_logging(log_json=True)
         
         # Verificar parámetros de línea de comandos
         autostart_mode = '--autostart' in sys.argv
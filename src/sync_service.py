@@ -24,6 +24,7 @@ from datetime import datetime
 from logging.handlers import RotatingFileHandler
 import signal
 import threading
+from cliente_http import post_json
 
 # Variables globales
 running = True
@@ -226,9 +227,9 @@ def send_data_to_server(datos, config):
         
         logging.info(f"📤 Enviando {len(datos)} registros al servidor...")
         
-        response = requests.post(
+        response = post_json(
             server_url,
-            json=datos,
+            datos,
             headers=headers,
             timeout=30
         )
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 STATUS_MAP = {
     0: "Entrada",
     1: "Salida",
@@ -19,3 +21,60 @@ def detectar_turno(hora):
     if TURNOS['nocturno']['inicio'] <= hora or hora < TURNOS['nocturno']['fin']:
         return 'nocturno'
     return 'diurno'
+
+
+# ————— Timestamps de los registros —————
+# El timestamp ISO de un registro se parsea una sola vez por operación: el
+# datetime y los segundos desde 1970 se guardan en un FechasRegistros aparte,
+# sin agregar claves a los registros del llamador.
+EPOCA = datetime(1970, 1, 1)
+_timestamps_parseados = 0
+
+def parsear_timestamp(texto):
+    """Convierte un timestamp ISO a datetime, contando cuántas veces se parsea"""
+    global _timestamps_parseados
+    _timestamps_parseados += 1
+    return datetime.fromisoformat(texto)
+
+def contar_timestamps_parseados():
+    """Número de timestamps parseados desde que arrancó el proceso"""
+    return _timestamps_parseados
+
+def epoca_de_fecha(fecha):
+    """
+    Segundos desde 1970 de un datetime. Con zona horaria es el instante real;
+    sin zona (como los entrega el dispositivo) es la hora local tal cual.
+    """
+    if fecha.tzinfo is not None:
+        return fecha.timestamp()
+    return (fecha - EPOCA).total_seconds()
+
+class FechasRegistros:
+    """
+    datetime y época de los registros (diccionarios) de una operación,
+    parseados la primera vez y reutilizados después. Una misma instancia se
+    puede pasar por procesar_registros, calcular_horas_todos y
+    formatear_registros_para_envio para parsear cada timestamp una sola vez.
+    Se indexan por id del registro y se guarda una referencia a él, así el id
+    no se reutiliza mientras viva la instancia.
+    """
+
+    __slots__ = ('_fechas',)
+
+    def __init__(self):
+        self._fechas = {}
+
+    def _parsear(self, registro):
+        entrada = self._fechas.get(id(registro))
+        if entrada is None:
+            fecha = parsear_timestamp(registro['timestamp'])
+            entrada = self._fechas[id(registro)] = (registro, fecha, epoca_de_fecha(fecha))
+        return entrada
+
+    def fecha(self, registro):
+        """datetime del registro"""
+        return self._parsear(registro)[1]
+
+    def epoca(self, registro):
+        """Segundos desde 1970 del registro, para ordenar y comparar sin texto"""
+        return self._parsear(registro)[2]